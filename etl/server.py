@@ -1,32 +1,55 @@
 import os
 import emd
+import json
 import time
+import hashlib
+import queue
+import threading
 import traceback
+import numpy as np
 import pandas as pd
 from enum import Enum
 
 import uvicorn
-from fastapi import FastAPI
-from typing import List, Dict, Optional
+from fastapi import FastAPI, HTTPException
+from typing import List, Dict, Literal, Optional, Tuple
 from pydantic import BaseModel
-from util.types import OHLCV, FFD, EMD, PremiumIndex
-from util.pg_sync import Connection
-import pymarketstore as pymkts
-
-from prefect import flow, task, get_run_logger
+from util.types import emd_columns
+from util.pg_sync import get_connection
+from util.pg import get_async_writer
+from util.encode import ohlcvt_rows, ffd_rows, emd_rows, emd_compact_rows, premium_index_rows
+from util.ohlcv import bars_since, cascade_ohlcv, resample_ohlcv
+from util.cache import OhlcvtCache
+from util.ms import get_marketstore
+from util.ffd import auto_backoff_ticks, frac_diff_ffd, get_ffd_stream
+from util.pool import ffd_emd
+from util.emd_window import compare_emd, emd_window
+from util.rolling_emd import RollingEMD
+from util.partition import PARTITIONED_TABLES, months_before
+from util.jobs import JobQueue
+from util.singleflight import SingleFlight
+
+from prefect import flow, task, runtime, get_run_logger
 from prefect.task_runners import ConcurrentTaskRunner
-from prefect.futures import wait
+from prefect.futures import PrefectFuture, wait
 from prefect.utilities.annotations import quote
-from mlfinlab.features.fracdiff import frac_diff_ffd
-
 
-marketstore_url = os.environ.get("MARKETSTORE_URL", None)
 
 # TODO: remove Volume, Trades from columns
 columns = ["Open", "High", "Low", "Close", "Volume", "Trades"]
 
+# 1Minバーのローカルキャッシュ (OHLCVT_CACHE_DIR)
+ohlcvt_cache = OhlcvtCache()
+
 app = FastAPI()
 
+# POST /jobs で受け付けたリクエストを実行するワーカー (ETL_JOB_WORKERS, ETL_JOB_QUEUE)
+# スレッドはstartupで起動する。プロセスプールのワーカーがモジュールを読み込んでも起動しない
+jobs = JobQueue()
+
+# 同じ計算を実行中のリクエストはその結果を待って受け取る
+in_flight = SingleFlight()
+
 
 class OhlcvtSource(Enum):
     MarketStore = "market_store"
@@ -87,13 +110,27 @@ InstrumentUnion = Instrument | InstrumentPair
 
 
 class Request(BaseModel):
-    resolution: str
+    resolution: Optional[str] = None
+    resolutions: Optional[List[str]] = None
     inst: List[InstrumentUnion]
     source: Optional[OhlcvtSource] = OhlcvtSource.MarketStore
     thresh: Optional[float] = None
-    fdim: Optional[float] = None
+    fdim: Optional[float | List[float]] = None  # リストを渡すとfdimのスイープになる
+    sweep_emd: Optional[bool] = None
     max_imfs: Optional[int] = None
-    backoff_ticks: Optional[int] = None
+    backoff_ticks: Optional[int | Literal["auto"]] = None
+    emd_margin_ticks: Optional[int] = None
+    incremental: Optional[bool] = None
+    overlap_ticks: Optional[int] = None
+    use_cache: Optional[bool] = None
+    streaming_ffd: Optional[bool] = None
+    executor: Optional[Literal["thread", "process"]] = None
+    incremental_emd: Optional[bool] = None
+    emd_window_ticks: Optional[int] = None
+    emd_tolerance: Optional[float] = None
+    rolling_emd_window: Optional[int] = None
+    async_writer: Optional[bool] = None
+    emd_table: Optional[Literal["emd", "emd_compact"]] = None
 
 
 class Parameter(BaseModel):
@@ -102,6 +139,20 @@ class Parameter(BaseModel):
     fdim: float
     max_imfs: int
     backoff_ticks: int
+    incremental: bool = False
+    overlap_ticks: int = 0
+    use_cache: bool = False
+    streaming_ffd: bool = False
+    fdims: Optional[List[float]] = None
+    sweep_emd: bool = False
+    executor: Literal["thread", "process"] = "thread"
+    incremental_emd: bool = False
+    emd_window_ticks: int = 0
+    emd_margin_ticks: int = 0
+    emd_tolerance: float = 0.0
+    rolling_emd_window: int = 0
+    async_writer: bool = False
+    emd_table: Literal["emd", "emd_compact"] = "emd"
 
 
 # サンプルデータ
@@ -121,6 +172,21 @@ DEFAULT_PARAMETERS = {
     "fdim": 0.3,
     "max_imfs": 16,
     "backoff_ticks": 24 * 60 * 7,  # 1 week
+    "emd_margin_ticks": 24 * 60,  # backoff_ticks="auto" の時にFFDの窓長に加えるEMDの端点効果用の本数
+    "incremental": False,
+    "overlap_ticks": 5,  # 最新Epochより前に読み直す1Minバーの本数
+    "use_cache": "OHLCVT_CACHE_DIR" in os.environ,
+    "streaming_ffd": False,
+    "sweep_emd": False,
+    "executor": os.getenv("ETL_EXECUTOR", "thread"),  # "process" ならFFD/EMDをプロセスプールで計算する
+    "incremental_emd": False,
+    "emd_window_ticks": 24 * 60,  # incremental_emd の時に書き込む末尾の本数 (この前にemd_margin_ticks本を余分にsiftする)
+    "emd_tolerance": 1e-6,  # 保存済みの値からこれ以上動いた行だけをupsertする
+    "async_writer": False,  # Trueならffd/emdをバックグラウンドのasyncpgプールでCOPYし、その間に次の計算を進める
+    "emd_table": os.getenv("EMD_TABLE", "emd"),  # "emd_compact" ならIMFごとのreal[]配列で保存する (max_imfsの上限なし)
+    "rolling_emd_window": 0,  # 0より大きければ各バーをその前のこの本数だけでsiftした因果的なEMDも計算する
+    "retention_months": int(os.getenv("RETENTION_MONTHS", "24")),  # 今月を含めてこの月数より古いパーティションをretention_flowで削除する
+    "batch_workers": int(os.getenv("ETL_BATCH_WORKERS", "4")),  # batch_flowで同時に走らせる特徴量計算タスクの数
 }
 
 
@@ -128,200 +194,133 @@ DEFAULT_PARAMETERS = {
 Parameters = Dict[Resolution, Parameter]  # パラメータのリスト
 
 
-def OHLCV_from_df(instrument_id: int, df: pd.DataFrame) -> List[OHLCV]:
-    if "Epoch" not in df.columns:
-        df = df.reset_index().rename(columns={"index": "Epoch"})
-    v: List[OHLCV] = []
-    for row in df.itertuples():
-        d = OHLCV(
-            instrument_id,
-            row.Epoch.tz_localize(None),
-            row.Open,
-            row.High,
-            row.Low,
-            row.Close,
-            row.Volume,
-            row.Trades,
-        )
-        v += [d]
-    return v
-
-
-def FFD_from_df(instrument_id: int, resolution: Resolution, fdim: float, df: pd.DataFrame) -> List[FFD]:
-    if "Epoch" not in df.columns:
-        df = df.reset_index().rename(columns={"index": "Epoch"})
-    v: List[FFD] = []
-    for row in df.itertuples():
-        d = FFD(
-            instrument_id,
-            resolution.to_string(),
-            fdim,
-            row.Epoch.to_pydatetime(),
-            row.Open,
-            row.High,
-            row.Low,
-            row.Close,
-            row.Volume,
-            row.Trades,
-        )
-        v += [d]
-    return v
-
-
-def EMD_from_df(instrument_id: int, resolution: Resolution, fdim: float, df: pd.DataFrame):
-    if "Epoch" not in df.columns:
-        df = df.reset_index().rename(columns={"index": "Epoch"})
-    v: List[EMD] = []
-    for row in df.itertuples():
-        d = EMD(
-            instrument_id,
-            resolution.to_string(),
-            fdim,
-            row.Epoch.to_pydatetime(),
-            row.imf_0,
-            row.imf_1,
-            row.imf_2,
-            row.imf_3,
-            row.imf_4,
-            row.imf_5,
-            row.imf_6,
-            row.imf_7,
-            row.imf_8,
-            row.imf_9,
-            row.imf_10,
-            row.imf_11,
-            row.imf_12,
-            row.imf_13,
-            row.imf_14,
-            row.imf_15,
-            row.if_0,
-            row.if_1,
-            row.if_2,
-            row.if_3,
-            row.if_4,
-            row.if_5,
-            row.if_6,
-            row.if_7,
-            row.if_8,
-            row.if_9,
-            row.if_10,
-            row.if_11,
-            row.if_12,
-            row.if_13,
-            row.if_14,
-            row.if_15,
-            row.ia_0,
-            row.ia_1,
-            row.ia_2,
-            row.ia_3,
-            row.ia_4,
-            row.ia_5,
-            row.ia_6,
-            row.ia_7,
-            row.ia_8,
-            row.ia_9,
-            row.ia_10,
-            row.ia_11,
-            row.ia_12,
-            row.ia_13,
-            row.ia_14,
-            row.ia_15,
-            row.ip_0,
-            row.ip_1,
-            row.ip_2,
-            row.ip_3,
-            row.ip_4,
-            row.ip_5,
-            row.ip_6,
-            row.ip_7,
-            row.ip_8,
-            row.ip_9,
-            row.ip_10,
-            row.ip_11,
-            row.ip_12,
-            row.ip_13,
-            row.ip_14,
-            row.ip_15,
-        )
-        v += [d]
-    return v
-
-
-def PremiumIndex_from_df(instrument_id1: int, instrument_id2: int, resolution: Resolution, df: pd.DataFrame):
-    if "Epoch" not in df.columns:
-        df = df.reset_index().rename(columns={"index": "Epoch"})
-    v: List[PremiumIndex] = []
-    for row in df.itertuples():
-        d = PremiumIndex(
-            instrument_id1,
-            instrument_id2,
-            resolution.to_string(),
-            row.Epoch.to_pydatetime(),
-            row.premium_index,
-        )
-        v += [d]
-    return v
+# フローの実行IDごと、テーブルごとの送信行数。フローの戻り値としてジョブのステータスに載る
+row_counts: Dict[str, Dict[str, int]] = {}
+row_counts_lock = threading.Lock()
+
+
+def count_rows(table: str, n: int) -> None:
+    with row_counts_lock:
+        counts = row_counts.setdefault(str(runtime.flow_run.id), {})
+        counts[table] = counts.get(table, 0) + n
+
+
+def pop_row_counts() -> Dict[str, int]:
+    with row_counts_lock:
+        return row_counts.pop(str(runtime.flow_run.id), {})
+
+
+def release_flow_run(async_writer: bool) -> None:
+    # 失敗したフローの件数と書き込み待ちを残さない。成功時はpop/flush済みなので何もしない
+    pop_row_counts()
+    if async_writer:
+        discarded = get_async_writer().discard(str(runtime.flow_run.id))
+        if discarded:
+            get_run_logger().warning(f"Discarded {discarded} background writes of a failed flow")
+
+
+def write_rows(pg, rows: List[tuple], table: str) -> None:
+    """同期でupsertし、送信行数を数える"""
+    pg.send_rows(rows, table)
+    count_rows(table, len(rows))
+
+
+def send_rows(pg, p: Parameter, rows: List[tuple], table: str) -> None:
+    """p.async_writerならバックグラウンドのライターに渡してすぐに戻る。書き込みはフローの最後にflushで待つ"""
+    if p.async_writer:
+        get_async_writer().submit(rows, table, tag=str(runtime.flow_run.id))
+        count_rows(table, len(rows))
+    else:
+        write_rows(pg, rows, table)
+
+
+def params_id(pg, p: Parameter, fdim: Optional[float] = None) -> int:
+    """(fdim, p.thresh, p.max_imfs) のfeature_paramsのID。ffd/emdの行はfdimではなくこのIDをキーにする"""
+    return pg.register_params(p.fdim if fdim is None else fdim, p.thresh, p.max_imfs)
+
+
+def emd_table_rows(p: Parameter, instrument_id: int, resolution: str, params_id: int, emd_df: pd.DataFrame) -> List[tuple]:
+    """EMDブロックをp.emd_tableのレイアウトの行にする"""
+    if p.emd_table == "emd_compact":
+        return emd_compact_rows(instrument_id, resolution, params_id, emd_df)
+    return emd_rows(instrument_id, resolution, params_id, emd_df)
+
+
+def ohlcvt_synced(pg, inst: Instrument, p: Parameter) -> Optional[pd.Timestamp]:
+    """ohlcvtに保存済みの最後のバーからoverlap_ticks本だけ遡ったEpoch。Noneならまだ何も保存されていない"""
+    last_epoch = pg.fetch_last_epoch("ohlcvt", inst.ID)
+    # 最後のバーは未確定の可能性があるのでoverlap_ticks本だけ遡って取り直す
+    return None if last_epoch is None else pd.Timestamp(last_epoch, tz="UTC") - pd.Timedelta(minutes=p.overlap_ticks)
+
+
+def ohlcvt_since(p: Parameter, cached: Optional[pd.DataFrame], synced: Optional[pd.Timestamp], limit: int) -> Optional[pd.Timestamp]:
+    """上流から1Minバーを取得し始めるEpoch。Noneならウィンドウ全体を取得する"""
+    if p.use_cache:
+        # キャッシュの履歴が足りない場合はウィンドウ全体を取り直す
+        if len(cached) < limit:
+            return None
+        return cached.index[-1] - pd.Timedelta(minutes=p.overlap_ticks)
+    if p.incremental and p.ohlcvt_source == OhlcvtSource.MarketStore:
+        return synced
+    return None
 
 
 @task(log_prints=True)
-def ohlcvt_stream_task(pg, resolution: Resolution, inst: Instrument, ohlcvt_source: OhlcvtSource, backoff_ticks: int):
+def ohlcvt_stream_task(pg, resolution: Resolution, insts: List[Instrument], p: Parameter) -> Dict[int, pd.DataFrame]:
     logger = get_run_logger()
     
     try:
-        if ohlcvt_source == OhlcvtSource.MarketStore:
-            client = pymkts.Client(endpoint=f"http://{marketstore_url}:5993/rpc")
-
-            logger.info(f"Connected to marketstore for {inst} at {resolution}")
-
-            param = pymkts.Params(
-                inst.Name, "1Min", "OHLCV", limit=backoff_ticks * resolution.value / 60
-            )
-            reply = client.query(param)
-            df = reply.first().df().resample(f"{resolution.value}s").agg({
-                "Open": "first",
-                "High": "max",
-                "Low": "min",
-                "Close": "last",
-                "Volume": "sum",
-                "Trades": "sum",
-            })
-            
-            assert len(df) > 0, "No data retrieved"
-            
-            logger.info(f"Got {len(df)} rows")
-            data = OHLCV_from_df(inst.ID, df)
-            pg.send(data, "ohlcvt")
-            logger.info(f"Sent all records of {inst.Name} to Postgres")
-        
-        elif ohlcvt_source == OhlcvtSource.Postgres:
-            data = pg.fetch_all_by_inst("ohlcvt", inst.ID)
-            assert len(data) > 0, "No data retrieved"
-            
-            columns = ['instrument_id', 'Epoch', 'Open', 'High', 'Low', 'Close', 'Volume', 'Trades']
-            # Convert to DataFrame
-            df = pd.DataFrame(data, columns=columns)
-            # Convert Decimal columns to float after creation
-            decimal_columns = ['Open', 'High', 'Low', 'Close', 'Volume']
-            for col in decimal_columns:
-                df[col] = df[col].apply(float)
-            # Set 'Epoch' as the index
-            df.set_index('Epoch', inplace=True)
-            
-            df = pd.DataFrame(df).resample(f"{resolution.value}s").agg({
-                "Open": "first",
-                "High": "max",
-                "Low": "min",
-                "Close": "last",
-                "Volume": "sum",
-                "Trades": "sum",
-            })
-            logger.info(f"Got {len(df)} rows")
+        limit = p.backoff_ticks * resolution.value // Resolution.OneMin.value
+        cached = {inst.ID: ohlcvt_cache.read(inst.ID, limit) for inst in insts} if p.use_cache else {}
+        # MarketStoreから取得したバーはohlcvtに保存済みの範囲より後だけを書き込む
+        synced = {inst.ID: ohlcvt_synced(pg, inst, p) for inst in insts} if p.ohlcvt_source == OhlcvtSource.MarketStore else {}
+        since = {inst.ID: ohlcvt_since(p, cached.get(inst.ID), synced.get(inst.ID), limit) for inst in insts}
+
+        if p.ohlcvt_source == OhlcvtSource.MarketStore:
+            # 全インストゥルメントを1回の問い合わせでまとめて取得する
+            logger.info(f"Querying marketstore for {[inst.Name for inst in insts]} at {resolution}")
+            replies = get_marketstore().fetch({inst.Name: since[inst.ID] for inst in insts}, limit)
+            raw = {inst.ID: replies[inst.Name] for inst in insts}
+
+        elif p.ohlcvt_source == OhlcvtSource.Postgres:
+            raw = {}
+            for inst in insts:
+                if since[inst.ID] is None:
+                    raw[inst.ID] = pg.fetch_ohlcvt_window(inst.ID, limit * Resolution.OneMin.value)
+                else:
+                    raw[inst.ID] = pg.fetch_ohlcvt_since(inst.ID, since[inst.ID].tz_convert(None).to_pydatetime())
 
         else:
-            logger.warning(f"Invalid source: {ohlcvt_source}")
-            raise ValueError(f"Invalid source: {ohlcvt_source}")
+            logger.warning(f"Invalid source: {p.ohlcvt_source}")
+            raise ValueError(f"Invalid source: {p.ohlcvt_source}")
+
+        dfs = {}
+        for inst in insts:
+            df = raw[inst.ID]
+            logger.info(f"Got {len(df)} 1Min rows of {inst.Name}")
+
+            if p.ohlcvt_source == OhlcvtSource.MarketStore:
+                # ohlcvtには常に1Minバーのまま保存する (incrementalやPostgresソースはここから1Minで読み直して集約する)。
+                # 保存済みの範囲はoverlap_ticks本を除いて書き直さないので、毎回ウィンドウ全体をupsertすることはない
+                new = bars_since(df, synced[inst.ID])
+                if len(new) > 0:
+                    write_rows(pg, ohlcvt_rows(inst.ID, new), "ohlcvt")
+                    logger.info(f"Sent {len(new)} of {len(df)} 1Min records of {inst.Name} to Postgres")
+
+            if p.use_cache:
+                df = ohlcvt_cache.update(inst.ID, cached[inst.ID], df, limit)
+            elif p.incremental and p.ohlcvt_source == OhlcvtSource.MarketStore:
+                # 特徴量計算用のウィンドウは同期済みのohlcvtから読む
+                df = pg.fetch_ohlcvt_window(inst.ID, limit * Resolution.OneMin.value)
+
+            df = resample_ohlcv(df, resolution.value)
 
-        return df
+            assert len(df) > 0, "No data retrieved"
+
+            logger.info(f"Got {len(df)} rows")
+            dfs[inst.ID] = df
+
+        return dfs
 
     except Exception as e:
         print(e)
@@ -332,45 +331,75 @@ def ohlcvt_stream_task(pg, resolution: Resolution, inst: Instrument, ohlcvt_sour
 
 @task(log_prints=True)
 def ffd_stream_task(pg, resolution: Resolution, instrument_id: int, p: Parameter, df: pd.DataFrame):
-    df = df.resample(f"{resolution.value}s").agg(
-        {
-            "Open": "first",
-            "High": "max",
-            "Low": "min",
-            "Close": "last",
-            "Volume": "sum",
-            "Trades": "sum",
-        }
-    )
-    
+    # ohlcvt_stream_taskで既にresolutionに集約済みなら何もしない
+    df = resample_ohlcv(df, resolution.value)
+    pid = params_id(pg, p)
+
+    if p.streaming_ffd:
+        # 前回までに計算済みのバーは再計算せず、新しいバーのFFDだけをupsertする
+        stream = get_ffd_stream((instrument_id, resolution, p.fdim, p.thresh), p.fdim, p.thresh, p.backoff_ticks)
+        new_df = stream.update(df[columns]).dropna()
+        send_rows(pg, p, ffd_rows(instrument_id, resolution.to_string(), pid, new_df), "ffd")
+        return stream.output.loc[df.index[0]:].dropna()
+
     ffd_df = frac_diff_ffd(df[columns], p.fdim, p.thresh).dropna()
-    data = FFD_from_df(instrument_id, resolution, p.fdim, ffd_df)
-    pg.send(data, "ffd")
+    send_rows(pg, p, ffd_rows(instrument_id, resolution.to_string(), pid, ffd_df), "ffd")
     return ffd_df
 
 
-@task(log_prints=True)
-def emd_stream_task(pg, resolution: Resolution, instrument_id: int, p: Parameter, ffd_df: pd.DataFrame):
-    l: int = len(ffd_df)
-    emd_df = pd.DataFrame({}, index=ffd_df.index)
-
-    imfs = emd.sift.sift(ffd_df["Close"].values, max_imfs=p.max_imfs)
+def calc_emd(ffd_df: pd.DataFrame, max_imfs: int) -> pd.DataFrame:
+    """FFDのCloseをEMDで分解してIMF/IF/IA/IPを1つのfloat64ブロックに計算 (存在しないIMFはNaN)"""
+    imfs = emd.sift.sift(ffd_df["Close"].values, max_imfs=max_imfs)
     # imfnum = min(imfs.shape[1], max_imfs)
 
     sample_rate = len(ffd_df.index)/((ffd_df.index[-1] - ffd_df.index[0]).seconds)
     IP, IF, IA = emd.spectra.frequency_transform(imfs, sample_rate, 'nht')
 
-    for i in range(0, p.max_imfs):
-        emd_df[f"imf_{i}"] = imfs[:, i] if imfs.shape[1] > i else [None] * l  # Intrinsic Mode Function
-        emd_df[f"ip_{i}"] = IP[:, i] if IP.shape[1] > i else [None] * l  # Instantaneous Power
-        emd_df[f"if_{i}"] = IF[:, i] if IF.shape[1] > i else [None] * l  # Instantaneous Frequency
-        emd_df[f"ia_{i}"] = IA[:, i] if IA.shape[1] > i else [None] * l  # Instantaneous Amplitude
+    # Intrinsic Mode Function, Instantaneous Frequency, Instantaneous Amplitude, Instantaneous Power の順
+    n = min(imfs.shape[1], max_imfs)
+    block = np.full((len(ffd_df), 4 * max_imfs), np.nan)
+    for k, values in enumerate([imfs, IF, IA, IP]):
+        block[:, k * max_imfs:k * max_imfs + n] = values[:, :n]
+    return pd.DataFrame(block, index=ffd_df.index, columns=emd_columns(max_imfs), copy=False)
 
-    data = EMD_from_df(instrument_id, resolution, p.fdim, emd_df)
-    pg.send(data, "emd")
+
+@task(log_prints=True)
+def emd_stream_task(pg, resolution: Resolution, instrument_id: int, p: Parameter, ffd_df: pd.DataFrame):
+    logger = get_run_logger()
+    pid = params_id(pg, p)
+    if p.incremental_emd:
+        # 末尾のウィンドウだけをsiftし、先頭のマージンは端点効果を吸収するために捨てる
+        window_df = calc_emd(emd_window(ffd_df, p.emd_window_ticks, p.emd_margin_ticks), p.max_imfs)
+        fresh_df = window_df.iloc[p.emd_margin_ticks:]
+        if fresh_df.empty:
+            logger.warning(f"Incremental EMD of {instrument_id} at {resolution}: only {len(ffd_df)} FFD rows, none left after the {p.emd_margin_ticks} margin rows. Increase backoff_ticks")
+            return window_df
+        fetch_stored = pg.fetch_emd_compact_since if p.emd_table == "emd_compact" else pg.fetch_emd_since
+        stored_df = fetch_stored(instrument_id, resolution.to_string(), pid, fresh_df.index[0].to_pydatetime())
+        changed, divergence = compare_emd(fresh_df, stored_df, p.emd_tolerance)
+        logger.info(f"Incremental EMD of {instrument_id} at {resolution}: {changed.sum()}/{len(fresh_df)} rows changed")
+        if divergence:
+            # 保存済み(全系列でsiftした)値との差。大きければemd_margin_ticksを増やす
+            logger.info(f"Max |imf - stored imf|: {divergence}")
+        send_rows(pg, p, emd_table_rows(p, instrument_id, resolution.to_string(), pid, fresh_df[changed]), p.emd_table)
+        return window_df
+
+    emd_df = calc_emd(ffd_df, p.max_imfs)
+    send_rows(pg, p, emd_table_rows(p, instrument_id, resolution.to_string(), pid, emd_df), p.emd_table)
     return emd_df
 
 
+@task(log_prints=True)
+def rolling_emd_task(pg, resolution: Resolution, instrument_id: int, p: Parameter, ffd_df: pd.DataFrame):
+    """学習用に未来のバーを使わないEMDを計算し、ROLLING_EMD_DIRにチェックポイントしながら保存する"""
+    logger = get_run_logger()
+    # fdim, thresh, max_imfsの組ごとに別のチェックポイントにする
+    engine = RollingEMD(f"{instrument_id}_{resolution.to_string()}_p{params_id(pg, p)}", p.rolling_emd_window, p.max_imfs)
+    rolling_df = engine.run(ffd_df["Close"])
+    logger.info(f"Rolling EMD of {instrument_id} at {resolution}: {len(rolling_df)} bars in {engine.path}")
+    return rolling_df
+
+
 @task(log_prints=True)
 def premium_index_stream_task(pg, inst_pair: InstrumentPair, resolution: Resolution, primary_df: pd.DataFrame, secondary_df: pd.DataFrame):
     logger = get_run_logger()
@@ -386,82 +415,244 @@ def premium_index_stream_task(pg, inst_pair: InstrumentPair, resolution: Resolut
             logger.warning("Primary or secondary DataFrame is empty")
             return
 
-        primary_df = primary_df.resample(f"{resolution.value}s").agg(
-            {
-                "Open": "first",
-                "High": "max",
-                "Low": "min",
-                "Close": "last",
-                "Volume": "sum",
-                "Trades": "sum",
-            }
-        )
-        secondary_df = secondary_df.resample(f"{resolution.value}s").agg(
-            {
-                "Open": "first",
-                "High": "max",
-                "Low": "min",
-                "Close": "last",
-                "Volume": "sum",
-                "Trades": "sum",
-            }
-        )
+        primary_df = resample_ohlcv(primary_df, resolution.value)
+        secondary_df = resample_ohlcv(secondary_df, resolution.value)
         
         premium_index = (secondary_df["Close"] - primary_df["Close"]) / primary_df["Close"] * 100
         df = premium_index.dropna().to_frame(name='premium_index')
-        data = PremiumIndex_from_df(inst_pair.Primary.ID, inst_pair.Secondary.ID, resolution, df)
-        pg.send(data, "premium_index")
+        write_rows(pg, premium_index_rows(inst_pair.Primary.ID, inst_pair.Secondary.ID, resolution.to_string(), df), "premium_index")
         return
     except Exception as e:
         logger.error(traceback.format_exc())
         raise e
 
 
+@task(log_prints=True)
+def fdim_sweep_task(pg, resolution: Resolution, instrument_id: int, p: Parameter, df: pd.DataFrame):
+    """共通のOHLCVからp.fdimsの全てのFFD(とEMD)を計算し、テーブルごとに1回で書き込む"""
+    logger = get_run_logger()
+
+    df = resample_ohlcv(df, resolution.value)
+
+    ffd_data, emd_data = [], []
+    for fdim in p.fdims:
+        pid = params_id(pg, p, fdim)
+        ffd_df = frac_diff_ffd(df[columns], fdim, p.thresh).dropna()
+        ffd_data += ffd_rows(instrument_id, resolution.to_string(), pid, ffd_df)
+        if p.sweep_emd:
+            emd_data += emd_table_rows(p, instrument_id, resolution.to_string(), pid, calc_emd(ffd_df, p.max_imfs))
+
+    send_rows(pg, p, ffd_data, "ffd")
+    if emd_data:
+        send_rows(pg, p, emd_data, p.emd_table)
+    logger.info(f"Swept {len(p.fdims)} fdims of instrument {instrument_id} at {resolution}")
+
+
+@task(log_prints=True)
+def features_process_task(pg, resolution: Resolution, instrument_id: int, p: Parameter, df: pd.DataFrame):
+    """FFDとEMDをプロセスプールで計算する。GILに縛られないので複数銘柄のタスクが並列に動く"""
+    df = resample_ohlcv(df, resolution.value)
+    ffd_df, emd_df = ffd_emd(df[columns], p.fdim, p.thresh, p.max_imfs)
+    pid = params_id(pg, p)
+    send_rows(pg, p, ffd_rows(instrument_id, resolution.to_string(), pid, ffd_df), "ffd")
+    send_rows(pg, p, emd_table_rows(p, instrument_id, resolution.to_string(), pid, emd_df), p.emd_table)
+    return emd_df
+
+
 @task(log_prints=True)
 def calc_features_task(pg, p: Parameter, resolution: Resolution, df: pd.DataFrame, instrument_id: int):
+    if p.fdims:
+        return fdim_sweep_task.submit(pg, resolution, instrument_id, p, df).result()
+    if p.executor == "process" and not p.streaming_ffd and not p.incremental_emd and p.rolling_emd_window == 0:
+        return features_process_task.submit(pg, resolution, instrument_id, p, df).result()
     ffd_df = ffd_stream_task.submit(pg, resolution, instrument_id, p, df)
     emd_df = emd_stream_task.submit(pg, resolution, instrument_id, p, ffd_df.result())
+    if p.rolling_emd_window > 0:
+        rolling_emd_task.submit(pg, resolution, instrument_id, p, ffd_df.result()).result()
     return emd_df
 
 
 @flow(log_prints=True, task_runner=ConcurrentTaskRunner())
 def etl_flow(resolution: Resolution, inst: InstrumentUnion, p: Parameter):
     logger = get_run_logger()
-    
-    pg = Connection()
-    pg.connection_test()
-    logger.info("Connected to Postgres")
-    
-    tasks = []
-    if isinstance(inst, Instrument):
-        df_task = ohlcvt_stream_task.submit(pg, resolution, inst, p.ohlcvt_source, p.backoff_ticks)
-        feature_task = calc_features_task.submit(pg, p, resolution, df_task.result(), inst.ID)
-        tasks.append(feature_task)
-    elif isinstance(inst, InstrumentPair):
-        primary_task = ohlcvt_stream_task.submit(pg, resolution, inst.Primary, p.ohlcvt_source, p.backoff_ticks)
-        secondary_task = ohlcvt_stream_task.submit(pg, resolution, inst.Secondary, p.ohlcvt_source, p.backoff_ticks)
-        feature_task_primary = calc_features_task.submit(pg, p, resolution, primary_task.result(), inst.Primary.ID)
-        feature_task_secondary = calc_features_task.submit(pg, p, resolution, secondary_task.result(), inst.Secondary.ID)
-        premium_task = premium_index_stream_task.submit(pg, inst, resolution, primary_task.result(), secondary_task.result(), wait_for=[feature_task_primary, feature_task_secondary])
-        tasks.extend([feature_task_primary, feature_task_secondary, premium_task])
-    else:
-        logger.warning(f"Invalid type: {type(inst)}")
-    wait(tasks)
-    logger.info("Updated for all instruments")
 
+    try:
+        pg = get_connection()
+        pg.connection_test()
+        logger.info("Connected to Postgres")
+
+        tasks = []
+        if isinstance(inst, Instrument):
+            df_task = ohlcvt_stream_task.submit(pg, resolution, [inst], p)
+            feature_task = calc_features_task.submit(pg, p, resolution, df_task.result()[inst.ID], inst.ID)
+            tasks.append(feature_task)
+        elif isinstance(inst, InstrumentPair):
+            # PrimaryとSecondaryは1回の問い合わせでまとめて取得する
+            dfs = ohlcvt_stream_task.submit(pg, resolution, [inst.Primary, inst.Secondary], p).result()
+            feature_task_primary = calc_features_task.submit(pg, p, resolution, dfs[inst.Primary.ID], inst.Primary.ID)
+            feature_task_secondary = calc_features_task.submit(pg, p, resolution, dfs[inst.Secondary.ID], inst.Secondary.ID)
+            premium_task = premium_index_stream_task.submit(pg, inst, resolution, dfs[inst.Primary.ID], dfs[inst.Secondary.ID], wait_for=[feature_task_primary, feature_task_secondary])
+            tasks.extend([feature_task_primary, feature_task_secondary, premium_task])
+        else:
+            logger.warning(f"Invalid type: {type(inst)}")
+        wait(tasks)
+        if p.async_writer:
+            written = get_async_writer().flush(str(runtime.flow_run.id))
+            logger.info(f"Flushed {written} rows written in the background")
+        logger.info("Updated for all instruments")
+        return pop_row_counts()
+    finally:
+        release_flow_run(p.async_writer)
 
-@app.post("/")
-def root(req: Request):
-    start = time.time()
-    
-    resolution = Resolution.from_string(req.resolution)
+
+@flow(log_prints=True, task_runner=ConcurrentTaskRunner())
+def etl_multi_flow(resolutions: List[Resolution], inst: InstrumentUnion, params: Parameters):
+    logger = get_run_logger()
+
+    try:
+        pg = get_connection()
+        pg.connection_test()
+        logger.info("Connected to Postgres")
+
+        if isinstance(inst, Instrument):
+            insts = [inst]
+        elif isinstance(inst, InstrumentPair):
+            insts = [inst.Primary, inst.Secondary]
+        else:
+            logger.warning(f"Invalid type: {type(inst)}")
+            return
+
+        # 全解像度のウィンドウをカバーする本数の1Minバーを一度だけ取得する
+        base_ticks = max(params[r].backoff_ticks * r.value // Resolution.OneMin.value for r in resolutions)
+        # 最大の解像度に合わせた長いウィンドウでも、ohlcvtに書き込むのは保存済みの範囲より後のバーだけ
+        base_p = params[resolutions[0]].model_copy(update={"backoff_ticks": base_ticks})
+        base = ohlcvt_stream_task.submit(pg, Resolution.OneMin, insts, base_p).result()
+
+        # 5Min -> 15Min -> ... -> 1D と前の解像度から順に集約する
+        frames = {i.ID: cascade_ohlcv(base[i.ID], [r.value for r in resolutions]) for i in insts}
+
+        tasks = []
+        for resolution in resolutions:
+            p = params[resolution]
+            dfs = {i.ID: frames[i.ID][resolution.value].iloc[-p.backoff_ticks:] for i in insts}
+            feature_tasks = [calc_features_task.submit(pg, p, resolution, dfs[i.ID], i.ID) for i in insts]
+            tasks.extend(feature_tasks)
+            if isinstance(inst, InstrumentPair):
+                premium_task = premium_index_stream_task.submit(pg, inst, resolution, dfs[inst.Primary.ID], dfs[inst.Secondary.ID], wait_for=feature_tasks)
+                tasks.append(premium_task)
+        wait(tasks)
+        if any(params[r].async_writer for r in resolutions):
+            written = get_async_writer().flush(str(runtime.flow_run.id))
+            logger.info(f"Flushed {written} rows written in the background")
+        logger.info(f"Updated for all instruments at {[r.to_string() for r in resolutions]}")
+        return pop_row_counts()
+    finally:
+        release_flow_run(any(params[r].async_writer for r in resolutions))
+
+
+@task(log_prints=True)
+def bounded_features_task(slots: threading.BoundedSemaphore, pg, p: Parameter, resolution: Resolution, df: pd.DataFrame, instrument_id: int):
+    """slotsに空きができてからcalc_features_taskの本体を実行し、終わるまで枠を持つ。
+    入れ子のタスクは上限のないタスクランナーで走るので、枠を持ったまま待ってもデッドロックしない"""
+    with slots:
+        emd_df = calc_features_task.fn(pg, p, resolution, df, instrument_id)
+        return emd_df.result() if isinstance(emd_df, PrefectFuture) else emd_df
+
+
+@flow(log_prints=True, task_runner=ConcurrentTaskRunner())
+def batch_flow(resolutions: List[Resolution], targets: List[InstrumentUnion], params: Parameters, max_workers: int):
+    """単独の銘柄とペアをまとめて処理する。同じ銘柄の取得と(銘柄, 解像度)ごとの特徴量計算は1回だけ行う"""
+    logger = get_run_logger()
+
+    try:
+        pg = get_connection()
+        pg.connection_test()
+        logger.info("Connected to Postgres")
+
+        insts: Dict[int, Instrument] = {}
+        pairs: Dict[Tuple[int, int], InstrumentPair] = {}
+        for target in targets:
+            if isinstance(target, InstrumentPair):
+                pairs.setdefault((target.Primary.ID, target.Secondary.ID), target)
+                members = [target.Primary, target.Secondary]
+            else:
+                members = [target]
+            for inst in members:
+                insts.setdefault(inst.ID, inst)
+        logger.info(f"Batch of {len(targets)} targets: {len(insts)} instruments, {len(pairs)} pairs")
+        # 特徴量計算の同時実行数だけを制限する。タスクランナー自体を絞ると入れ子のタスクが詰まる
+        slots = threading.BoundedSemaphore(max_workers)
+
+        # 全銘柄、全解像度のウィンドウをカバーする1Minバーを一度だけ取得して集約する
+        base_ticks = max(params[r].backoff_ticks * r.value // Resolution.OneMin.value for r in resolutions)
+        # 最大の解像度に合わせた長いウィンドウでも、ohlcvtに書き込むのは保存済みの範囲より後のバーだけ
+        base_p = params[resolutions[0]].model_copy(update={"backoff_ticks": base_ticks})
+        base = ohlcvt_stream_task.submit(pg, Resolution.OneMin, list(insts.values()), base_p).result()
+        frames = {i: cascade_ohlcv(base[i], [r.value for r in resolutions]) for i in insts}
+
+        tasks = []
+        for resolution in resolutions:
+            p = params[resolution]
+            dfs = {i: frames[i][resolution.value].iloc[-p.backoff_ticks:] for i in insts}
+            feature_tasks = {i: bounded_features_task.submit(quote(slots), pg, p, resolution, dfs[i], i) for i in insts}
+            tasks.extend(feature_tasks.values())
+            for (primary, secondary), pair in pairs.items():
+                premium_task = premium_index_stream_task.submit(
+                    pg, pair, resolution, dfs[primary], dfs[secondary],
+                    wait_for=[feature_tasks[primary], feature_tasks[secondary]],
+                )
+                tasks.append(premium_task)
+        wait(tasks)
+        if any(params[r].async_writer for r in resolutions):
+            written = get_async_writer().flush(str(runtime.flow_run.id))
+            logger.info(f"Flushed {written} rows written in the background")
+        logger.info(f"Updated {len(insts)} instruments and {len(pairs)} pairs at {[r.to_string() for r in resolutions]}")
+        return pop_row_counts()
+    finally:
+        release_flow_run(any(params[r].async_writer for r in resolutions))
+
+
+def validate_retention(keep_months: int, tables: Optional[List[str]] = None):
+    # keep_monthsが0以下だと今月のパーティションまで消えてしまう
+    if keep_months < 1:
+        raise ValueError(f"keep_months must be at least 1: {keep_months}")
+    unknown = [t for t in tables or [] if t not in PARTITIONED_TABLES]
+    if unknown:
+        raise ValueError(f"Tables not partitioned: {unknown}")
+
+
+@flow(log_prints=True)
+def retention_flow(keep_months: int, tables: Optional[List[str]] = None):
+    """古い月のパーティションをDELETEではなくDETACHしてDROPする"""
+    logger = get_run_logger()
+    validate_retention(keep_months, tables)
+    pg = get_connection()
+    before = months_before(pd.Timestamp.now(tz="UTC").date(), keep_months)
+    dropped = []
+    for table in tables or PARTITIONED_TABLES:
+        dropped += pg.drop_partitions_before(table, before)
+    logger.info(f"Dropped {len(dropped)} partitions before {before}: {dropped}")
+    return dropped
+
+
+def resolve_resolutions(req: Request) -> List[Resolution]:
+    if req.resolutions:
+        return [Resolution.from_string(r) for r in req.resolutions]
+    if req.resolution:
+        return [Resolution.from_string(req.resolution)]
+    raise ValueError("No 'resolution' in request")
+
+
+def resolve_request(req: Request):
+    """リクエストを対象の解像度、銘柄、解像度ごとのパラメータにする。不正なら理由をValueErrorで返す"""
+    target_resolutions = resolve_resolutions(req)
     
     if req.inst is None:
-        return {"message": "No 'inst' in request"}
+        raise ValueError("No 'inst' in request")
     if len(req.inst) == 0:
-        return {"message": "No instruments"}
+        raise ValueError("No instruments")
     if len(req.inst) > 2:
-        return {"message": "Too many instruments"}
+        raise ValueError("Too many instruments")
     if len(req.inst) == 1:
         inst = req.inst[0]
     if len(req.inst) == 2:
@@ -470,20 +661,68 @@ def root(req: Request):
             Secondary=req.inst[1]
         )
 
+    return target_resolutions, inst, resolve_params(req)
+
+
+def resolve_params(req: Request) -> Parameters:
+    """リクエストで省略されたパラメータをDEFAULT_PARAMETERSで埋める"""
     thresh = DEFAULT_PARAMETERS["thresh"] if req.thresh is None else req.thresh
     max_imfs = DEFAULT_PARAMETERS["max_imfs"] if req.max_imfs is None else req.max_imfs
     fdim = DEFAULT_PARAMETERS["fdim"] if req.fdim is None else req.fdim
+    # 重複したfdimは1回のupsertで同じ行を2回更新してしまい失敗するので除く
+    fdims = sorted(set(fdim)) if isinstance(fdim, list) else [fdim]
+    fdim = fdims[0]
+    fdims = fdims if len(fdims) > 1 else None
+    sweep_emd = DEFAULT_PARAMETERS["sweep_emd"] if req.sweep_emd is None else req.sweep_emd
     backoff_ticks = DEFAULT_PARAMETERS["backoff_ticks"] if req.backoff_ticks is None else req.backoff_ticks
+    emd_margin_ticks = DEFAULT_PARAMETERS["emd_margin_ticks"] if req.emd_margin_ticks is None else req.emd_margin_ticks
+    incremental = DEFAULT_PARAMETERS["incremental"] if req.incremental is None else req.incremental
+    overlap_ticks = DEFAULT_PARAMETERS["overlap_ticks"] if req.overlap_ticks is None else req.overlap_ticks
+    use_cache = DEFAULT_PARAMETERS["use_cache"] if req.use_cache is None else req.use_cache
+    streaming_ffd = DEFAULT_PARAMETERS["streaming_ffd"] if req.streaming_ffd is None else req.streaming_ffd
+    executor = DEFAULT_PARAMETERS["executor"] if req.executor is None else req.executor
+    incremental_emd = DEFAULT_PARAMETERS["incremental_emd"] if req.incremental_emd is None else req.incremental_emd
+    emd_window_ticks = DEFAULT_PARAMETERS["emd_window_ticks"] if req.emd_window_ticks is None else req.emd_window_ticks
+    if backoff_ticks == "auto":
+        # FFDの重みの長さ + EMDのマージン (+ incremental_emdなら書き込むウィンドウ) 分だけ取得する
+        backoff_ticks = max(
+            auto_backoff_ticks(f, thresh, emd_margin_ticks, emd_window_ticks if incremental_emd else 0)
+            for f in (fdims or [fdim])
+        )
+    emd_tolerance = DEFAULT_PARAMETERS["emd_tolerance"] if req.emd_tolerance is None else req.emd_tolerance
+    rolling_emd_window = DEFAULT_PARAMETERS["rolling_emd_window"] if req.rolling_emd_window is None else req.rolling_emd_window
+    async_writer = DEFAULT_PARAMETERS["async_writer"] if req.async_writer is None else req.async_writer
+    emd_table = DEFAULT_PARAMETERS["emd_table"] if req.emd_table is None else req.emd_table
 
     params: Parameters = {resol: Parameter(
-        ohlcvt_source=req.source, fdim=fdim, max_imfs=max_imfs, thresh=thresh, backoff_ticks=backoff_ticks
+        ohlcvt_source=req.source, fdim=fdim, max_imfs=max_imfs, thresh=thresh, backoff_ticks=backoff_ticks,
+        incremental=incremental, overlap_ticks=overlap_ticks, use_cache=use_cache, streaming_ffd=streaming_ffd,
+        fdims=fdims, sweep_emd=sweep_emd, executor=executor,
+        incremental_emd=incremental_emd, emd_window_ticks=emd_window_ticks, emd_margin_ticks=emd_margin_ticks,
+        emd_tolerance=emd_tolerance, rolling_emd_window=rolling_emd_window, async_writer=async_writer,
+        emd_table=emd_table,
     ) for resol in resolutions}
 
-    etl_flow(
-        resolution,
-        inst,
-        params[resolution],
-    )
+    return params
+
+
+def run_request(target_resolutions: List[Resolution], inst: InstrumentUnion, params: Parameters):
+    start = time.time()
+
+    if len(target_resolutions) == 1:
+        resolution = target_resolutions[0]
+        rows = etl_flow(
+            resolution,
+            inst,
+            params[resolution],
+        )
+    else:
+        resolution = target_resolutions
+        rows = etl_multi_flow(
+            target_resolutions,
+            inst,
+            params,
+        )
     
     end_time = time.time()
 
@@ -491,10 +730,128 @@ def root(req: Request):
         "message": "Success",
         "resolution": resolution,
         "inst": inst,
+        "rows": rows,
         "elapsed_time": end_time - start,
     }
 
 
+def request_key(target_resolutions: List[Resolution], inst: InstrumentUnion, params: Parameters) -> str:
+    """解決済みのParameterと銘柄IDの正規化したハッシュ。キーが同じリクエストは同じ行を書き込む"""
+    resolutions = sorted(target_resolutions, key=lambda r: r.value)
+    ids = [inst.Primary.ID, inst.Secondary.ID] if isinstance(inst, InstrumentPair) else [inst.ID]
+    payload = {
+        "resolutions": [r.to_string() for r in resolutions],
+        "inst": ids,
+        "params": {r.to_string(): params[r].model_dump(mode="json") for r in resolutions},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def coalesced_run_request(target_resolutions: List[Resolution], inst: InstrumentUnion, params: Parameters):
+    """同じキーのフローが実行中なら新たに走らせず、その結果を返す"""
+    key = request_key(target_resolutions, inst, params)
+    result, shared = in_flight.do(key, run_request, target_resolutions, inst, params)
+    return {**result, "coalesced": shared}
+
+
+@app.on_event("startup")
+def start_jobs():
+    jobs.start()
+
+
+@app.post("/")
+def root(req: Request):
+    try:
+        target_resolutions, inst, params = resolve_request(req)
+    except ValueError as e:
+        return {"message": str(e)}
+    return coalesced_run_request(target_resolutions, inst, params)
+
+
+@app.post("/jobs")
+def submit_job(req: Request):
+    """リクエストをキューに入れてすぐにジョブIDを返す。進捗は GET /jobs/{id} で見る"""
+    try:
+        target_resolutions, inst, params = resolve_request(req)
+    except ValueError as e:
+        return {"message": str(e)}
+    try:
+        job = jobs.submit(coalesced_run_request, target_resolutions, inst, params)
+    except queue.Full:
+        raise HTTPException(status_code=429, detail="Too many queued jobs")
+    return {"message": "Accepted", "job_id": job.id, "status": job.status}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.to_dict()
+
+
+class BatchRequest(Request):
+    inst: List[InstrumentUnion]  # 要素ごとに単独の銘柄 {"ID", "Name"} かペア {"Primary", "Secondary"}
+    max_workers: Optional[int] = None
+
+
+def run_batch(target_resolutions: List[Resolution], targets: List[InstrumentUnion], params: Parameters, max_workers: int):
+    start = time.time()
+    rows = batch_flow(
+        target_resolutions,
+        targets,
+        params,
+        max_workers,
+    )
+    return {
+        "message": "Success",
+        "resolution": target_resolutions,
+        "inst": targets,
+        "rows": rows,
+        "elapsed_time": time.time() - start,
+    }
+
+
+@app.post("/batch")
+def submit_batch(req: BatchRequest):
+    """多数の銘柄、ペア、解像度を1つのジョブにする。進捗は GET /jobs/{id} で見る"""
+    try:
+        target_resolutions = resolve_resolutions(req)
+    except ValueError as e:
+        return {"message": str(e)}
+    if not req.inst:
+        return {"message": "No instruments"}
+    max_workers = DEFAULT_PARAMETERS["batch_workers"] if req.max_workers is None else req.max_workers
+    if max_workers < 1:
+        return {"message": "max_workers must be at least 1"}
+    try:
+        job = jobs.submit(run_batch, target_resolutions, req.inst, resolve_params(req), max_workers)
+    except queue.Full:
+        raise HTTPException(status_code=429, detail="Too many queued jobs")
+    return {"message": "Accepted", "job_id": job.id, "status": job.status}
+
+
+class RetentionRequest(BaseModel):
+    keep_months: Optional[int] = None
+    tables: Optional[List[str]] = None
+
+
+@app.post("/retention")
+def retention(req: RetentionRequest):
+    start = time.time()
+    keep_months = DEFAULT_PARAMETERS["retention_months"] if req.keep_months is None else req.keep_months
+    try:
+        validate_retention(keep_months, req.tables)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    dropped = retention_flow(keep_months, req.tables)
+    return {
+        "message": "Success",
+        "dropped": dropped,
+        "elapsed_time": time.time() - start,
+    }
+
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8080))
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The flows import the utilities as the top-level package "util" (run from etl/)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
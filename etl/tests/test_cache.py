@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from util.cache import OhlcvtCache
+
+
+def bars(start: str, n: int, close: float = 100.0) -> pd.DataFrame:
+    values = close + np.arange(n, dtype=np.float64)
+    return pd.DataFrame(
+        {
+            "Open": values, "High": values + 1, "Low": values - 1, "Close": values,
+            "Volume": np.ones(n), "Trades": np.ones(n, dtype=np.int64),
+        },
+        index=pd.date_range(start, periods=n, freq="1min", tz="UTC", name="Epoch"),
+    )
+
+
+def files_per_day(cache: OhlcvtCache, instrument_id: int) -> dict:
+    path = os.path.join(cache.root, str(instrument_id))
+    return {day: len(os.listdir(os.path.join(path, day))) for day in sorted(os.listdir(path))}
+
+
+def test_read_trims_to_limit(tmp_path):
+    cache = OhlcvtCache(str(tmp_path))
+    assert cache.read(1, 10).empty
+    df = bars("2024-01-01 23:00", 120)
+    cache.append(1, df)
+    out = cache.read(1, 30)
+    assert len(out) == 30
+    pd.testing.assert_frame_equal(out, df.iloc[-30:], check_freq=False)
+    assert len(cache.read(1, 1000)) == 120
+
+
+def test_only_the_rolled_over_day_is_compacted(tmp_path):
+    cache = OhlcvtCache(str(tmp_path))
+    cache.append(1, bars("2024-01-01 23:50", 5))
+    cache.append(1, bars("2024-01-01 23:55", 3))
+    # 当日はappendごとのファイルのまま
+    assert files_per_day(cache, 1) == {"2024-01-01": 2}
+
+    cache.append(1, bars("2024-01-01 23:58", 5))
+    assert files_per_day(cache, 1) == {"2024-01-01": 1, "2024-01-02": 1}
+
+    cache.append(1, bars("2024-01-02 00:03", 2))
+    # 遅れて届いた過去の日のバーはその日だけをまとめ直す
+    cache.append(1, bars("2024-01-01 12:00", 1))
+    assert files_per_day(cache, 1) == {"2024-01-01": 1, "2024-01-02": 2}
+
+    out = cache.read(1, 100)
+    assert len(out) == 16
+    assert out.index.is_monotonic_increasing and out.index.is_unique
+
+
+def test_update_rewrites_the_overlap(tmp_path):
+    cache = OhlcvtCache(str(tmp_path))
+    window = bars("2024-01-01 00:00", 60)
+    cache.append(1, window)
+
+    # 最後の2本は未確定だったので取り直した値で上書きされる
+    new = bars("2024-01-01 00:58", 5, close=500.0)
+    out = cache.update(1, cache.read(1, 60), new, 60)
+    assert len(out) == 60
+    assert out.index[-1] == new.index[-1]
+    pd.testing.assert_frame_equal(out.iloc[-5:], new, check_freq=False)
+    pd.testing.assert_frame_equal(out.iloc[:-5], window.iloc[3:58], check_freq=False)
+    # キャッシュを読み直しても同じ
+    pd.testing.assert_frame_equal(cache.read(1, 60), out, check_freq=False)
+
+    assert cache.update(1, out, new.iloc[:0], 60) is out
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from util.ffd import FFDStream, ffd_weights, frac_diff_ffd
+
+
+def reference_frac_diff_ffd(series: pd.DataFrame, fdim: float, thresh: float) -> pd.DataFrame:
+    """mlfinlab.features.fracdiff.frac_diff_ffd (1.0.x), bar by bar"""
+    w, k = [1.0], 1
+    while True:
+        w_ = -w[-1] / k * (fdim - k + 1)
+        if abs(w_) < thresh:
+            break
+        w.append(w_)
+        k += 1
+        if k == series.shape[0]:
+            break
+    w = np.array(w[::-1]).reshape(-1, 1)
+    width = len(w) - 1
+
+    out = {}
+    for name in series.columns:
+        series_f = series[[name]].ffill().dropna()
+        col = pd.Series(index=series.index, dtype="float64")
+        for iloc1 in range(width, series_f.shape[0]):
+            loc0, loc1 = series_f.index[iloc1 - width], series.index[iloc1]
+            if not np.isfinite(series.loc[loc1, name]):
+                continue
+            col[loc1] = np.dot(w.T, series_f.loc[loc0:loc1])[0, 0]
+        out[name] = col
+    return pd.DataFrame(out)
+
+
+def ohlcvt(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(size=n))
+    df = pd.DataFrame(
+        {
+            "Open": close + rng.normal(size=n), "High": close + 1, "Low": close - 1, "Close": close,
+            "Volume": rng.uniform(1, 10, size=n), "Trades": rng.integers(1, 100, size=n).astype(np.float64),
+        },
+        index=pd.date_range("2024-01-01", periods=n, freq="1min", tz="UTC"),
+    )
+    df.iloc[[40, 41, 200], :] = np.nan  # 欠損バー
+    return df
+
+
+@pytest.mark.parametrize("fdim, thresh", [(0.3, 1e-2), (0.5, 1e-3), (0.8, 1e-4)])
+def test_matches_mlfinlab(fdim, thresh):
+    df = ohlcvt(600)
+    expected = reference_frac_diff_ffd(df, fdim, thresh)
+    actual = frac_diff_ffd(df, fdim, thresh)
+    pd.testing.assert_frame_equal(actual, expected, check_freq=False, rtol=1e-10, atol=1e-10)
+
+
+def test_fft_matches_direct():
+    fdim, thresh = 0.3, 1e-5
+    assert len(ffd_weights(fdim, thresh)) > 512
+    df = ohlcvt(6000)
+    df.iloc[:5] = np.nan  # 先頭の空のビンがFFTで列全体に広がらないこと
+    direct = frac_diff_ffd(df, fdim, thresh)
+    fft = frac_diff_ffd(df, fdim, thresh, fft=True)
+    assert direct.dropna().shape == fft.dropna().shape
+    pd.testing.assert_frame_equal(fft, direct, check_freq=False, rtol=1e-6, atol=1e-6)
+
+
+def test_overlapping_windows_are_identical():
+    fdim, thresh = 0.3, 1e-5
+    df = ohlcvt(6000)
+    full = frac_diff_ffd(df, fdim, thresh)
+    tail = frac_diff_ffd(df.iloc[1234:], fdim, thresh)
+    both = tail.dropna().index
+    assert len(both) > 0
+    np.testing.assert_array_equal(tail.loc[both].to_numpy(), full.loc[both].to_numpy())
+
+
+def test_stream_matches_frac_diff_ffd():
+    fdim, thresh = 0.4, 1e-3
+    df = ohlcvt(1500)
+    stream = FFDStream(fdim, thresh, history=len(df))
+    stream.update(df.iloc[:1000])
+    new = stream.update(df.iloc[:1200])
+    expected = frac_diff_ffd(df.iloc[:1200], fdim, thresh)
+    np.testing.assert_array_equal(new.to_numpy(), expected.loc[new.index].to_numpy())
+
+
+def test_stream_restarts_after_a_gap():
+    fdim, thresh = 0.4, 1e-3
+    width = len(ffd_weights(fdim, thresh))
+    df = ohlcvt(4000)
+    stream = FFDStream(fdim, thresh, history=len(df))
+    stream.update(df.iloc[:1000])
+    # 保持している末尾より2000本後から始まるウィンドウ
+    window = df.iloc[3000:4000]
+    new = stream.update(window)
+    expected = frac_diff_ffd(window, fdim, thresh)
+    assert new.index[0] == window.index[width - 1]
+    np.testing.assert_array_equal(new.to_numpy(), expected.loc[new.index].to_numpy())
+    pd.testing.assert_frame_equal(stream.output, new)
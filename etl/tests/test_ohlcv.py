@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from util.ohlcv import OHLCV_AGG, aggregate_ohlcv, bars_since, cascade_ohlcv
+
+
+def bars(start: str, n: int) -> pd.DataFrame:
+    close = 100 + np.arange(n, dtype=np.float64)
+    return pd.DataFrame(
+        {"Open": close, "High": close + 1, "Low": close - 1, "Close": close, "Volume": 1.0, "Trades": 1},
+        index=pd.date_range(start, periods=n, freq="1min", tz="UTC", name="Epoch"),
+    )
+
+
+def test_bars_since_keeps_only_unsynced_bars():
+    df = bars("2024-01-01", 600)
+    synced = pd.Timestamp("2024-01-01 09:55", tz="UTC")
+    new = bars_since(df, synced)
+    assert new.index[0] == synced
+    assert len(new) == 5
+    assert bars_since(df, None) is df
+    assert bars_since(df, df.index[-1] + pd.Timedelta(minutes=1)).empty
+
+
+def test_multi_resolution_base_writes_only_the_overlap():
+    # etl_multi_flowの共有ウィンドウは最大の解像度 (1D) に合わせて長くなるが、書き込むのは差分だけ
+    base = bars("2024-01-01", 14 * 1440)
+    overlap_ticks = 3
+    synced = base.index[-2] - pd.Timedelta(minutes=overlap_ticks)
+    new = bars_since(base, synced)
+    assert len(new) == overlap_ticks + 2
+    frames = cascade_ohlcv(base, [60, 300, 900, 3600, 14400, 86400])
+    assert len(frames[86400]) == 14
+    assert len(frames[60]) == len(base)
+
+
+def minute_bars(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(size=n))
+    df = pd.DataFrame(
+        {
+            "Open": close + rng.normal(size=n), "High": close + 2, "Low": close - 2, "Close": close,
+            "Volume": rng.uniform(1, 10, size=n), "Trades": rng.integers(1, 100, size=n),
+        },
+        # 00:17から始めるので最初の1H/4H/1Dのビンは途中から
+        index=pd.date_range("2024-01-01 00:17", periods=n, freq="1min", tz="UTC", name="Epoch"),
+    )
+    # 6時間分のバーがないので空のビンができる
+    return df.drop(df.index[600:960])
+
+
+@pytest.mark.parametrize("seconds", [300, 3600, 14400, 86400])
+def test_aggregate_matches_resample(seconds):
+    df = minute_bars(4 * 1440)
+    expected = df.resample(f"{seconds}s").agg(OHLCV_AGG)
+    actual = aggregate_ohlcv(df, seconds)
+    assert actual.index[0] < df.index[0]  # 途中から始まる最初のビン
+    if seconds < 86400:
+        assert actual["Close"].isna().any()  # 空のビンも残る
+    pd.testing.assert_frame_equal(actual, expected, check_freq=False)
+
+
+def test_cascade_matches_resample():
+    df = minute_bars(4 * 1440)
+    frames = cascade_ohlcv(df, [86400, 3600, 14400])
+    for seconds in [3600, 14400, 86400]:
+        expected = df.resample(f"{seconds}s").agg(OHLCV_AGG)
+        pd.testing.assert_frame_equal(frames[seconds], expected, check_freq=False)
@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+
+from util.pool import ProcessPool
+
+
+def _crash(inputs, outputs):
+    os._exit(1)  # OOM killerに殺されたワーカーと同じ
+
+
+def _double(inputs, outputs):
+    outputs["y"][...] = inputs["x"] * 2
+
+
+def test_pool_recovers_from_a_dead_worker():
+    pool = ProcessPool(max_workers=1)
+    try:
+        x = np.arange(4, dtype=np.float64)
+        with pytest.raises(BrokenProcessPool):
+            pool.run(_crash, {"x": x}, {"y": ((4,), "f8")})
+        out = pool.run(_double, {"x": x}, {"y": ((4,), "f8")})
+        np.testing.assert_array_equal(out["y"], x * 2)
+    finally:
+        pool.shutdown()
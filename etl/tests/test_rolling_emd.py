@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+
+from util.rolling_emd import RollingEMD
+from util.types import emd_columns
+
+
+def test_checkpoint_of_unnamed_index_reads_back(tmp_path):
+    engine = RollingEMD("1_1H_p1", window=8, max_imfs=2, root=str(tmp_path))
+    columns = emd_columns(2)
+    df = pd.DataFrame(
+        np.arange(4 * len(columns), dtype=np.float64).reshape(4, -1),
+        index=pd.date_range("2024-01-01", periods=4, freq="1h", tz="UTC"),
+        columns=columns,
+    )
+    assert df.index.name is None
+    engine._write(df)
+    out = engine.read()
+    assert out.index.name == "Epoch"
+    pd.testing.assert_frame_equal(out, df.rename_axis("Epoch"), check_freq=False)
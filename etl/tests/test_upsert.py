@@ -0,0 +1,38 @@
+import re
+
+import pytest
+
+from util.upsert import CONFLICT_KEYS, UPSERT_COLUMNS, delta_clause, updated_columns
+
+
+def test_delta_clause_compares_every_updated_column():
+    clause = delta_clause("ffd", "ffd_y2024m01")
+    updated = ["Open", "High", "Low", "Close", "Volume", "Trades"]
+    assert updated_columns("ffd") == updated
+    assert clause == (
+        "WHERE (" + ", ".join(f"ffd_y2024m01.{c}" for c in updated) + ") "
+        "IS DISTINCT FROM (" + ", ".join(f"EXCLUDED.{c}" for c in updated) + ")"
+    )
+    assert delta_clause("premium_index") == "WHERE (premium_index.PremiumIndex) IS DISTINCT FROM (EXCLUDED.PremiumIndex)"
+
+
+@pytest.mark.parametrize("table", sorted(UPSERT_COLUMNS))
+def test_sync_upserts_match_columns(table):
+    pg_sync = pytest.importorskip("util.pg_sync")
+    query = getattr(pg_sync, f"UPSERT_{table.upper()}_QUERY")
+    # delta_queryはクエリ文字列ではなくUPSERT_COLUMNSを使うので、両者がずれていないこと
+    inserted = query[query.index("(") + 1:query.index(")")].split(", ")
+    conflict = re.search(r"ON CONFLICT \(([^)]*)\)", query).group(1).split(", ")
+    updated = re.findall(r"^(\w+) = EXCLUDED\.\1", query, flags=re.M)
+    assert inserted == UPSERT_COLUMNS[table]
+    assert conflict == CONFLICT_KEYS[table]
+    assert updated == updated_columns(table)
+
+    delta = pg_sync.delta_query(query, table, f"{table}_y2024m01")
+    assert delta.endswith(f"\n{delta_clause(table, f'{table}_y2024m01')}\nRETURNING 1;\n")
+
+
+@pytest.mark.parametrize("table", sorted(UPSERT_COLUMNS))
+def test_async_staging_matches_columns(table):
+    pg = pytest.importorskip("util.pg")
+    assert [name for name, _ in pg.STAGING_COLUMNS[table]] == UPSERT_COLUMNS[table]
@@ -0,0 +1,157 @@
+# OHLCVT Cache
+# Local on-disk cache of 1Min OHLCVT bars per instrument
+#
+
+import os
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from typing import Dict, List, Optional
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+COLUMNS = ["Open", "High", "Low", "Close", "Volume", "Trades"]
+
+SCHEMA = pa.schema([
+    ("Epoch", pa.timestamp("ns", tz="UTC")),
+    ("Open", pa.float64()),
+    ("High", pa.float64()),
+    ("Low", pa.float64()),
+    ("Close", pa.float64()),
+    ("Volume", pa.float64()),
+    ("Trades", pa.int64()),
+])
+
+
+class OhlcvtCache:
+    """
+    Append-only cache of 1Min OHLCVT bars stored as uncompressed Arrow IPC files,
+    partitioned by instrument and day: {root}/{instrument}/{YYYY-MM-DD}/{written_ns}.arrow
+
+    Files are opened with memory mapping and a read stops at the oldest day the
+    window needs; the bars are copied once, when they are converted to a sorted
+    DataFrame. Bars written later win over earlier ones with the same Epoch
+    (re-finalized partial bars).
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.getenv("OHLCVT_CACHE_DIR", "/tmp/ohlcvt_cache")
+        self._locks: Dict[int, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, instrument_id: int) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(instrument_id, threading.Lock())
+
+    def _inst_dir(self, instrument_id: int) -> str:
+        return os.path.join(self.root, str(instrument_id))
+
+    def _days(self, instrument_id: int) -> List[str]:
+        path = self._inst_dir(instrument_id)
+        if not os.path.isdir(path):
+            return []
+        return sorted(d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d)))
+
+    def _files(self, instrument_id: int, day: str) -> List[str]:
+        path = os.path.join(self._inst_dir(instrument_id), day)
+        return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".arrow"))
+
+    def _read_day(self, instrument_id: int, day: str) -> Optional[pa.Table]:
+        tables = []
+        for path in self._files(instrument_id, day):
+            with pa.memory_map(path, "r") as source:
+                tables.append(pa.ipc.open_file(source).read_all())
+        if not tables:
+            return None
+        return pa.concat_tables(tables)
+
+    def _write(self, instrument_id: int, day: str, table: pa.Table) -> None:
+        path = os.path.join(self._inst_dir(instrument_id), day)
+        os.makedirs(path, exist_ok=True)
+        dst = os.path.join(path, f"{time.time_ns():020d}.arrow")
+        tmp = dst + ".tmp"
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, SCHEMA) as writer:
+                writer.write_table(table)
+        os.replace(tmp, dst)
+
+    def _compact(self, instrument_id: int, day: str) -> None:
+        """
+        Rewrites a closed day as a single file
+        """
+        files = self._files(instrument_id, day)
+        if len(files) < 2:
+            return
+        df = to_frame(self._read_day(instrument_id, day))
+        self._write(instrument_id, day, from_frame(df))
+        for path in files:
+            os.remove(path)
+
+    def append(self, instrument_id: int, df: pd.DataFrame) -> None:
+        """
+        Appends 1Min bars (indexed by Epoch) to the day partitions they belong to
+        """
+        if df.empty:
+            return
+        table = from_frame(df)
+        days = pc.strftime(table["Epoch"], format="%Y-%m-%d").to_numpy(zero_copy_only=False)
+        written = [str(day) for day in np.unique(days)]
+        with self._lock(instrument_id):
+            cached = self._days(instrument_id)
+            last = cached[-1] if cached else None
+            for day in written:
+                self._write(instrument_id, day, table.filter(pa.array(days == day)))
+            # 日が変わった前日と、遅れて届いたバーを書いた過去の日だけを1ファイルにまとめる
+            newest = max(written + cached[-1:])
+            for day in sorted({last, *written} - {None, newest}):
+                self._compact(instrument_id, day)
+        logging.debug(f"Cached {len(df)} bars of instrument {instrument_id}")
+
+    def update(self, instrument_id: int, window: pd.DataFrame, new: pd.DataFrame, limit: int) -> pd.DataFrame:
+        """
+        Appends `new` bars and returns the latest `limit` bars of `window` (a previous
+        read) merged with them, without reading the cache again
+        """
+        self.append(instrument_id, new)
+        if new.empty:
+            return window
+        merged = to_frame(pa.concat_tables([from_frame(window), from_frame(new)]))
+        return merged.iloc[-limit:]
+
+    def read(self, instrument_id: int, limit: int) -> pd.DataFrame:
+        """
+        Reads the latest `limit` cached bars of the instrument
+        """
+        tables, rows = [], 0
+        with self._lock(instrument_id):
+            for day in reversed(self._days(instrument_id)):
+                table = self._read_day(instrument_id, day)
+                if table is None:
+                    continue
+                tables.append(table)
+                rows += table.num_rows
+                if rows >= limit:
+                    break
+        if not tables:
+            return to_frame(SCHEMA.empty_table())
+        return to_frame(pa.concat_tables(reversed(tables))).iloc[-limit:]
+
+
+def from_frame(df: pd.DataFrame) -> pa.Table:
+    index = df.index
+    index = index.tz_localize("UTC") if index.tz is None else index.tz_convert("UTC")
+    arrays = [pa.array(index.values.astype("datetime64[ns]"), type=pa.timestamp("ns"))
+              .cast(pa.timestamp("ns", tz="UTC"))]
+    arrays += [pa.array(df[c].to_numpy(), type=SCHEMA.field(c).type) for c in COLUMNS]
+    return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def to_frame(table: pa.Table) -> pd.DataFrame:
+    df = table.to_pandas().set_index("Epoch")
+    df = df[~df.index.duplicated(keep="last")]
+    return df.sort_index()
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+
+
+def emd_window(ffd_df: pd.DataFrame, window_ticks: int, margin_ticks: int) -> pd.DataFrame:
+    """Trailing rows of ffd_df re-sifted by the incremental EMD.
+
+    The first margin_ticks rows are a warm-up that absorbs the edge effect at the
+    head of the window; only the window_ticks rows after them are written.
+    """
+    return ffd_df.iloc[-(window_ticks + margin_ticks):]
+
+
+def _naive_utc(index: pd.DatetimeIndex) -> pd.DatetimeIndex:
+    # emd.Epoch is TIMESTAMP (without time zone)
+    if index.tz is None:
+        return index
+    return index.tz_convert("UTC").tz_localize(None)
+
+
+def compare_emd(fresh: pd.DataFrame, stored: pd.DataFrame, tolerance: float) -> Tuple[np.ndarray, Dict[str, float]]:
+    """Compares a re-sifted window with the rows already stored for the same Epochs.
+
+    Returns the mask of rows of fresh that are new or moved beyond tolerance
+    (relative and absolute, NaN equals NaN) and the largest absolute difference
+    of every IMF over the rows present on both sides.
+    """
+    columns = list(fresh.columns)
+    new = fresh.to_numpy(dtype=np.float64)
+    old = stored.reindex(index=_naive_utc(fresh.index), columns=columns).to_numpy(dtype=np.float64)
+
+    same = np.isclose(new, old, rtol=tolerance, atol=tolerance, equal_nan=True).all(axis=1)
+    known = ~np.isnan(old).all(axis=1)
+    changed = ~(same & known)
+
+    diff = np.abs(new - old)[known]
+    divergence = {}
+    for i, c in enumerate(columns):
+        if c.startswith("imf_") and len(diff) and not np.isnan(diff[:, i]).all():
+            divergence[c] = float(np.nanmax(diff[:, i]))
+    return changed, divergence
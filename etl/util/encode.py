@@ -0,0 +1,78 @@
+# Row Encoding
+# Lays out DataFrames as rows in the column order of the tables, column by column
+#
+
+import numpy as np
+import pandas as pd
+from dataclasses import fields
+from typing import List
+
+from util.types import OHLCV, FFD, EMD_QUANTITIES, emd_columns
+
+# Value columns of each table, taken from the dataclasses that define the schema
+OHLCV_COLUMNS = [f.name for f in fields(OHLCV)][2:]
+FFD_COLUMNS = [f.name for f in fields(FFD)][4:]
+EMD_COLUMNS = emd_columns()  # fields(EMD)[4:] in lower case
+
+
+def _epochs(df: pd.DataFrame) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(df["Epoch"] if "Epoch" in df.columns else df.index)
+
+
+def _rows(keys: tuple, epochs: List, columns: List[List]) -> List[tuple]:
+    return [(*keys, epoch, *values) for epoch, *values in zip(epochs, *columns)]
+
+
+def ohlcvt_rows(instrument_id: int, df: pd.DataFrame) -> List[tuple]:
+    """
+    Rows of ohlcvt. Epoch is stored as the naive wall time of the index
+    """
+    epochs = _epochs(df)
+    if epochs.tz is not None:
+        epochs = epochs.tz_localize(None)
+    return _rows((instrument_id,), epochs.to_pydatetime().tolist(), [df[c].to_numpy().tolist() for c in OHLCV_COLUMNS])
+
+
+def ffd_rows(instrument_id: int, resolution: str, params_id: int, df: pd.DataFrame) -> List[tuple]:
+    """
+    Rows of ffd for one parameter set (id in feature_params)
+    """
+    epochs = _epochs(df).to_pydatetime().tolist()
+    return _rows((instrument_id, resolution, params_id), epochs, [df[c].to_numpy().tolist() for c in FFD_COLUMNS])
+
+
+def emd_rows(instrument_id: int, resolution: str, params_id: int, df: pd.DataFrame) -> List[tuple]:
+    """
+    Rows of emd from an EMD block (float columns named by emd_columns, NaN for
+    absent IMFs). NaN is written as NULL and IMFs beyond 16 are not stored.
+    """
+    block = df.reindex(columns=EMD_COLUMNS).to_numpy(dtype=np.float64)
+    values = block.astype(object)
+    values[np.isnan(block)] = None
+    epochs = _epochs(df).to_pydatetime().tolist()
+    return _rows((instrument_id, resolution, params_id), epochs, list(values.T))
+
+
+def emd_compact_rows(instrument_id: int, resolution: str, params_id: int, df: pd.DataFrame) -> List[tuple]:
+    """
+    Rows of emd_compact from an EMD block of any max_imfs: one float4 list per
+    quantity (imf, if, ia, ip), truncated to the IMFs present in the block
+    """
+    max_imfs = len(df.columns) // len(EMD_QUANTITIES)
+    block = df.reindex(columns=emd_columns(max_imfs)).to_numpy(dtype=np.float64)
+    imfs = block[:, :max_imfs]
+    n = int((~np.isnan(imfs).all(axis=0)).sum())
+    families = [
+        block[:, k * max_imfs:k * max_imfs + n].astype(np.float32).tolist()
+        for k in range(len(EMD_QUANTITIES))
+    ]
+    epochs = _epochs(df).to_pydatetime().tolist()
+    return _rows((instrument_id, resolution, params_id), epochs, families)
+
+
+def premium_index_rows(instrument_id1: int, instrument_id2: int, resolution: str, df: pd.DataFrame) -> List[tuple]:
+    """
+    Rows of premium_index
+    """
+    epochs = _epochs(df).to_pydatetime().tolist()
+    return _rows((instrument_id1, instrument_id2, resolution), epochs, [df["premium_index"].to_numpy().tolist()])
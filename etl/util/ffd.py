@@ -0,0 +1,208 @@
+import threading
+import numpy as np
+import pandas as pd
+from scipy import signal
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+@lru_cache(maxsize=256)
+def ffd_weights(fdim: float, thresh: float) -> np.ndarray:
+    """Weights of the fixed-width window fractional differentiation, newest bar first.
+
+    Same recursion as mlfinlab's get_weights_ffd: w_k = -w_{k-1} / k * (fdim - k + 1),
+    stopping at the first weight whose magnitude falls below thresh.
+    """
+    weights = [1.0]
+    k = 1
+    while True:
+        w = -weights[-1] / k * (fdim - k + 1)
+        if abs(w) < thresh:
+            break
+        weights.append(w)
+        k += 1
+    # 複数のスレッドで共有されるので書き換えられないようにする
+    weights = np.array(weights)
+    weights.setflags(write=False)
+    return weights
+
+
+def ffd_window(fdim: float, thresh: float) -> int:
+    """Number of bars consumed by one FFD output row"""
+    return len(ffd_weights(fdim, thresh))
+
+
+def auto_backoff_ticks(fdim: float, thresh: float, emd_margin_ticks: int, emd_window_ticks: int = 0) -> int:
+    """Bars needed to produce emd_margin_ticks + emd_window_ticks FFD rows: the first
+    row needs a full window. emd_window_ticks are the rows the incremental EMD writes
+    after its warm-up margin."""
+    return ffd_window(fdim, thresh) - 1 + emd_margin_ticks + emd_window_ticks
+
+
+# Rows of the input tail kept beyond the weight window, i.e. how far back an update
+# may revise already seen bars (re-finalized partial bars) and still be recomputed
+REVISION_TICKS = 64
+
+# Upper bound of elements materialized at once when applying the weights
+CHUNK_ELEMENTS = 1 << 22
+
+# Weight windows longer than this may be applied by FFT convolution (fft=True).
+# FFT rounding differs by ~1e-9 between overlapping windows, so the flows keep the
+# direct path: its rows are bit-identical whatever window they are computed in,
+# which FFDStream and the unchanged-row skipping of the upserts rely on.
+FFT_MIN_WIDTH = 512
+
+
+def apply_weights(filled: np.ndarray, weights: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """FFD values at the given row positions of a forward-filled (n, columns) array.
+
+    Row p is sum_k weights[k] * filled[p - k] for p >= len(weights) - 1.
+    """
+    width = len(weights)
+    windows = sliding_window_view(filled, width, axis=0)  # (n - width + 1, columns, width)
+    oldest_first = weights[::-1]
+    step = max(1, CHUNK_ELEMENTS // (width * filled.shape[1]))
+    out = np.empty((len(rows), filled.shape[1]))
+    for i in range(0, len(rows), step):
+        out[i:i + step] = windows[rows[i:i + step] - (width - 1)] @ oldest_first
+    return out
+
+
+def fft_weights(filled: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Same rows as apply_weights over every full window, by FFT convolution.
+
+    NaN (the head of a forward-filled series) is convolved as zero and the outputs
+    whose window holds a NaN are set back to NaN, so it does not spread to the column.
+    """
+    width = len(weights)
+    missing = ~np.isfinite(filled)
+    out = signal.fftconvolve(np.where(missing, 0.0, filled), weights[:, None], mode="valid", axes=0)
+    counts = np.cumsum(np.vstack([np.zeros((1, filled.shape[1])), missing]), axis=0)
+    out[(counts[width:] - counts[:-width]) > 0] = np.nan
+    return out
+
+
+def ffd_kernel(filled: np.ndarray, weights: np.ndarray, fft: bool = False) -> np.ndarray:
+    """FFD values of every full window of a forward-filled (n, columns) array.
+
+    Returns the rows len(weights) - 1 .. n - 1, all columns in one call: sliding
+    window dot products, or with fft FFT convolution for windows longer than FFT_MIN_WIDTH.
+    """
+    width = len(weights)
+    if len(filled) < width:
+        return np.empty((0, filled.shape[1]))
+    if fft and width > FFT_MIN_WIDTH:
+        return fft_weights(filled, weights)
+    return apply_weights(filled, weights, np.arange(width - 1, len(filled)))
+
+
+def frac_diff_ffd(series: pd.DataFrame, fdim: float, thresh: float = 1e-5, fft: bool = False) -> pd.DataFrame:
+    """Fixed-width window fractional differentiation of every column of series.
+
+    Drop-in for mlfinlab.features.fracdiff.frac_diff_ffd: weights are truncated to
+    len(series), inputs are forward-filled and rows whose input is not finite are NaN.
+    fft trades bit-exactness across windows for speed on long weight windows.
+    """
+    weights = ffd_weights(fdim, thresh)
+    if len(series) > 1:
+        weights = weights[:len(series)]
+    raw = series.to_numpy(dtype=np.float64)
+    out = np.full(raw.shape, np.nan)
+    out[len(weights) - 1:] = ffd_kernel(series.ffill().to_numpy(dtype=np.float64), weights, fft)
+    out[~np.isfinite(raw)] = np.nan
+    return pd.DataFrame(out, index=series.index, columns=series.columns)
+
+
+class FFDStream:
+    """
+    Incremental fractional differentiation of one (instrument, resolution, fdim, thresh) series.
+
+    Keeps the tail of the input sized to the weight window and computes FFD rows only
+    for bars that are new or changed since the previous update. Rows are identical
+    to frac_diff_ffd over any window holding at least len(weights) bars before them.
+    A window starting more than one bin after the retained tail (e.g. after the
+    stream sat idle longer than the window) restarts the stream from that window.
+    """
+
+    def __init__(self, fdim: float, thresh: float, history: int):
+        self.weights = ffd_weights(fdim, thresh)
+        self.history = history
+        self.raw: Optional[pd.DataFrame] = None
+        self.filled: Optional[pd.DataFrame] = None
+        self.output: Optional[pd.DataFrame] = None
+        self.lock = threading.Lock()
+
+    def _changed_from(self, df: pd.DataFrame) -> Optional[pd.Timestamp]:
+        """First Epoch of df that is not already in the tail with the same values"""
+        if self.raw is None:
+            return df.index[0]
+        known = self.raw.reindex(df.index)
+        same = ((known == df) | (known.isna() & df.isna())).all(axis=1).to_numpy()
+        changed = np.flatnonzero(~same)
+        return df.index[changed[0]] if len(changed) else None
+
+    def _continues(self, df: pd.DataFrame) -> bool:
+        """Whether df starts at most one bin after the last retained bar"""
+        steps = np.diff(self.raw.index.asi8)
+        if not (steps > 0).any():
+            steps = np.diff(df.index.asi8)
+        if not (steps > 0).any():
+            return False
+        step = steps[steps > 0].min()
+        return df.index[0].value <= self.raw.index[-1].value + step
+
+    def update(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Feeds bars (typically the latest window) and returns the FFD rows of the new
+        or changed bars. The FFD of the retained history is available as `output`.
+        """
+        with self.lock:
+            if self.raw is not None and len(df) > 0 and not self._continues(df):
+                # 末尾とつなぐと重みの窓がギャップをまたぐので、新しいウィンドウだけで計算し直す
+                self.raw = self.filled = self.output = None
+            if self.raw is not None:
+                df = df.loc[df.index >= self.raw.index[0]]
+            start = self._changed_from(df)
+            if start is None:
+                return df.iloc[:0]
+
+            if self.raw is None:
+                raw, filled = df, df.ffill()
+            else:
+                keep = self.raw.index < start
+                raw = pd.concat([self.raw.loc[keep], df.loc[start:]])
+                filled = pd.concat([self.filled.loc[keep], df.loc[start:]]).ffill()
+
+            width = len(self.weights)
+            rows = np.flatnonzero(raw.index >= start)
+            rows = rows[rows >= width - 1]
+            values = ffd_kernel(filled.to_numpy(dtype=np.float64)[len(raw) - len(rows) - (width - 1):], self.weights)
+            # 元の値が欠損しているバーは出力しない (frac_diff_ffdと同じ)
+            values[~np.isfinite(raw.to_numpy(dtype=np.float64)[rows])] = np.nan
+            new = pd.DataFrame(values, index=raw.index[rows], columns=raw.columns)
+
+            tail = width - 1 + REVISION_TICKS
+            self.raw, self.filled = raw.iloc[-tail:], filled.iloc[-tail:]
+            if self.output is None:
+                self.output = new
+            else:
+                self.output = pd.concat([self.output.loc[self.output.index < start], new])
+            self.output = self.output.iloc[-self.history:]
+            return new
+
+
+_streams: Dict[Tuple, FFDStream] = {}
+_streams_lock = threading.Lock()
+
+
+def get_ffd_stream(key: Tuple, fdim: float, thresh: float, history: int) -> FFDStream:
+    """
+    Returns the FFD stream of the process for key, e.g. (instrument, resolution, fdim, thresh)
+    """
+    with _streams_lock:
+        stream = _streams.get(key)
+        if stream is None:
+            stream = _streams[key] = FFDStream(fdim, thresh, history)
+        stream.history = max(stream.history, history)
+        return stream
@@ -0,0 +1,112 @@
+# Job Queue
+# Bounded in-process queue of jobs run by a fixed number of worker threads
+#
+
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+@dataclass
+class Job:
+    id: str
+    submitted_at: float
+    status: str = "queued"  # queued, running, succeeded, failed
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "id": self.id,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_time": (self.started_at or now) - self.submitted_at,
+            "elapsed_time": (self.finished_at or now) - self.started_at if self.started_at else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Runs submitted callables on ETL_JOB_WORKERS daemon threads.
+
+    At most ETL_JOB_QUEUE jobs wait for a worker; submit raises queue.Full beyond
+    that so the caller can reject the request instead of piling up work. The last
+    ETL_JOB_HISTORY finished jobs are kept for status polling. The worker threads
+    start on start(), not on construction, so importing the module spawns nothing.
+    """
+
+    def __init__(self, workers: Optional[int] = None, maxsize: Optional[int] = None, history: Optional[int] = None):
+        self.workers = workers or int(os.getenv("ETL_JOB_WORKERS", "2"))
+        self.history = history or int(os.getenv("ETL_JOB_HISTORY", "1000"))
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize or int(os.getenv("ETL_JOB_QUEUE", "64")))
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """
+        Starts the worker threads; calling it again does nothing
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [
+                threading.Thread(target=self._work, name=f"etl-job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Job:
+        """
+        Queues fn(*args, **kwargs) and returns its job at once. Raises queue.Full
+        when ETL_JOB_QUEUE jobs are already waiting.
+        """
+        job = Job(id=uuid.uuid4().hex, submitted_at=time.time())
+        self.queue.put_nowait((job, fn, args, kwargs))
+        with self._lock:
+            self.jobs[job.id] = job
+            self._evict()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _evict(self) -> None:
+        # 終了したジョブだけを古い順に捨てる
+        finished = [k for k, j in self.jobs.items() if j.finished_at is not None]
+        for k in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[k]
+
+    def _work(self) -> None:
+        while True:
+            job, fn, args, kwargs = self.queue.get()
+            job.status, job.started_at = "running", time.time()
+            try:
+                job.result = fn(*args, **kwargs)
+                job.status = "succeeded"
+            except Exception as e:
+                logging.error(f"Job {job.id} failed: {traceback.format_exc()}")
+                job.error, job.status = str(e), "failed"
+            finally:
+                job.finished_at = time.time()
+                with self._lock:
+                    self._evict()
+                self.queue.task_done()
@@ -0,0 +1,77 @@
+# MarketStore Connector
+# This file contains the process-wide client to query MarketStore
+#
+
+import os
+import logging
+import threading
+import pandas as pd
+import pymarketstore as pymkts
+from typing import Dict, List, Optional
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+COLUMNS = ["Open", "High", "Low", "Close", "Volume", "Trades"]
+
+
+class MarketStore:
+    """
+    MarketStore client shared by every flow of the process.
+    pymkts.Client keeps one requests.Session, so reusing the instance keeps the HTTP
+    connection alive between queries. Concurrent queries are bounded by a semaphore.
+    """
+
+    def __init__(self, url: Optional[str] = None, max_concurrency: Optional[int] = None):
+        url = url or os.environ.get("MARKETSTORE_URL", None)
+        self.client = pymkts.Client(endpoint=f"http://{url}:5993/rpc")
+        self.semaphore = threading.BoundedSemaphore(
+            max_concurrency or int(os.getenv("MARKETSTORE_MAX_CONCURRENCY", "4"))
+        )
+
+    def query(self, symbols: List[str], **kwargs) -> Dict[str, pd.DataFrame]:
+        """
+        Queries 1Min OHLCV of all symbols in one request and splits the reply per symbol
+        """
+        param = pymkts.Params(symbols, "1Min", "OHLCV", **kwargs)
+        with self.semaphore:
+            reply = self.client.query(param)
+        frames = {symbol: ds.df() for symbol, ds in reply.by_symbols().items()}
+        empty = pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], tz="UTC", name="Epoch"))
+        return {symbol: frames.get(symbol, empty) for symbol in symbols}
+
+    def fetch(self, since: Dict[str, Optional[pd.Timestamp]], limit: int) -> Dict[str, pd.DataFrame]:
+        """
+        Fetches the latest `limit` bars of the symbols mapped to None and the bars from
+        the given Epoch on for the others, in at most two round-trips
+        """
+        frames: Dict[str, pd.DataFrame] = {}
+
+        full = [symbol for symbol, start in since.items() if start is None]
+        if full:
+            frames.update(self.query(full, limit=limit))
+
+        partial = {symbol: start for symbol, start in since.items() if start is not None}
+        if partial:
+            replies = self.query(list(partial), start=min(partial.values()))
+            for symbol, start in partial.items():
+                df = replies[symbol]
+                frames[symbol] = df[df.index >= start]
+
+        logging.debug(f"Fetched {sum(len(df) for df in frames.values())} rows from MarketStore")
+        return frames
+
+
+_marketstore: Optional[MarketStore] = None
+_marketstore_lock = threading.Lock()
+
+
+def get_marketstore() -> MarketStore:
+    """
+    Returns the MarketStore client of the process, creating it on first use
+    """
+    global _marketstore
+    with _marketstore_lock:
+        if _marketstore is None:
+            _marketstore = MarketStore()
+        return _marketstore
@@ -0,0 +1,106 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+OHLCV_AGG = {
+    "Open": "first",
+    "High": "max",
+    "Low": "min",
+    "Close": "last",
+    "Volume": "sum",
+    "Trades": "sum",
+}
+
+# DataFrame.attrs key marking a frame whose bars are already at that width (seconds)
+RESOLUTION_ATTR = "resolution"
+
+
+def aggregate_ohlcv(df: pd.DataFrame, seconds: int) -> pd.DataFrame:
+    """Aggregates OHLCV bars into bins of `seconds` width.
+
+    Produces the same frame as df.resample(f"{seconds}s").agg(OHLCV_AGG): bins are
+    aligned to the epoch, empty bins are kept with NaN prices and zero sums. Bin
+    edges are computed once on the int64 epochs and every column is reduced with
+    ufunc.reduceat over the same edges.
+    """
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+
+    # Rows without a price are empty bins of a previous aggregation
+    close = df["Close"].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(close)
+    if not valid.any():
+        out = df.iloc[:0][list(OHLCV_AGG)].copy()
+        out.attrs[RESOLUTION_ATTR] = seconds
+        return out
+
+    step = seconds * 1_000_000_000
+    epochs = df.index.values.astype("datetime64[ns]").view(np.int64)[valid]
+    bins = epochs // step
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    ends = np.r_[starts[1:], len(bins)]
+    first_bin = bins[0]
+    nbins = int(bins[-1] - first_bin + 1)
+    pos = bins[starts] - first_bin
+
+    def take(name: str) -> np.ndarray:
+        return df[name].to_numpy()[valid]
+
+    def place(values: np.ndarray, fill) -> np.ndarray:
+        arr = np.full(nbins, fill, dtype=values.dtype)
+        arr[pos] = values
+        return arr
+
+    volume = take("Volume").astype(np.float64)
+    trades = take("Trades")
+    data = {
+        "Open": place(take("Open").astype(np.float64)[starts], np.nan),
+        "High": place(np.fmax.reduceat(take("High").astype(np.float64), starts), np.nan),
+        "Low": place(np.fmin.reduceat(take("Low").astype(np.float64), starts), np.nan),
+        "Close": place(close[valid][ends - 1], np.nan),
+        "Volume": place(np.add.reduceat(np.nan_to_num(volume), starts), 0.0),
+        "Trades": place(np.add.reduceat(trades, starts), 0),
+    }
+
+    index = pd.DatetimeIndex(
+        ((first_bin + np.arange(nbins)) * step).astype("datetime64[ns]"), name=df.index.name
+    )
+    if df.index.tz is not None:
+        index = index.tz_localize("UTC").tz_convert(df.index.tz)
+
+    out = pd.DataFrame(data, index=index)
+    out.attrs[RESOLUTION_ATTR] = seconds
+    return out
+
+
+def bars_since(df: pd.DataFrame, since: Optional[pd.Timestamp]) -> pd.DataFrame:
+    """Bars of df at or after `since`, or all of them when since is None"""
+    if since is None:
+        return df
+    return df[df.index >= since]
+
+
+def resample_ohlcv(df: pd.DataFrame, seconds: int) -> pd.DataFrame:
+    """Aggregates OHLCV bars into bins of `seconds` width, unless df is already at that resolution"""
+    if df.attrs.get(RESOLUTION_ATTR) == seconds:
+        return df
+    return aggregate_ohlcv(df, seconds)
+
+
+def cascade_ohlcv(base: pd.DataFrame, seconds: List[int], base_seconds: int = 60) -> Dict[int, pd.DataFrame]:
+    """Derives every requested resolution from the base bars.
+
+    Each level is aggregated from the previous (finer) level when its width is a
+    multiple of it, so 1D is built from 4H instead of from every 1Min bar again.
+    """
+    frames: Dict[int, pd.DataFrame] = {}
+    base = resample_ohlcv(base, base_seconds)
+    prev_seconds, prev = base_seconds, base
+    for s in sorted(set(seconds)):
+        if s % prev_seconds != 0:
+            prev_seconds, prev = base_seconds, base
+        frames[s] = resample_ohlcv(prev, s)
+        prev_seconds, prev = s, frames[s]
+    return frames
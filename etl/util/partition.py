@@ -0,0 +1,53 @@
+# Partitions
+# Monthly range partitions of the time series tables (sql/schema/008_partition_by_month.sql)
+#
+
+import re
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional
+
+PARTITIONED_TABLES = ["ohlcvt", "ffd", "emd", "emd_compact", "premium_index"]
+
+_SUFFIX = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def month_of(epoch: datetime) -> date:
+    """
+    First day of the month holding epoch, in UTC like the Epoch columns
+    """
+    if epoch.tzinfo is not None:
+        epoch = epoch.astimezone(timezone.utc)
+    return date(epoch.year, epoch.month, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    """
+    Name of the partition of table for month, as created by create_month_partition
+    """
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """
+    Month of a partition name, or None for a name not made by partition_name
+    """
+    m = _SUFFIX.search(name)
+    return date(int(m.group(1)), int(m.group(2)), 1) if m else None
+
+
+def group_by_month(rows: List[tuple], epoch: int) -> Dict[date, List[tuple]]:
+    """
+    Splits rows by the month of their Epoch (column index epoch), keeping the row order
+    """
+    groups: Dict[date, List[tuple]] = {}
+    for row in rows:
+        groups.setdefault(month_of(row[epoch]), []).append(row)
+    return groups
+
+
+def months_before(today: date, keep_months: int) -> date:
+    """
+    First month kept by a retention of keep_months months including the current one
+    """
+    index = today.year * 12 + today.month - 1 - (keep_months - 1)
+    return date(index // 12, index % 12 + 1, 1)
@@ -3,10 +3,17 @@
 #
 
 import os
+import time
+import asyncio
 import logging
 import asyncpg
-from typing import List
+import threading
+from concurrent.futures import Future
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Set
 from dataclasses import astuple
+from util.partition import PARTITIONED_TABLES, group_by_month, partition_name
+from util.upsert import CONFLICT_KEYS, delta_clause
 
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
@@ -75,13 +82,90 @@ Last = EXCLUDED.Last;
 """
 
 
+# Columns of the tables written by send_rows, in the order of the rows, with the
+# type of the staging table column. Values are staged as float8 so binary COPY
+# does not have to encode NUMERIC; the merge casts them to the table types. float8
+# columns go to NUMERIC through text: the direct cast rounds to 15 significant
+# digits, while the text output is the shortest round-trip form, the value the
+# synchronous connector stores from the Python float.
+STAGING_COLUMNS = {
+    "ohlcvt": [
+        ("Instrument", "bigint"), ("Epoch", "timestamp"), ("Open", "float8"), ("High", "float8"),
+        ("Low", "float8"), ("Close", "float8"), ("Volume", "float8"), ("Trades", "bigint"),
+    ],
+    "ffd": [
+        ("Instrument", "bigint"), ("Resolution", "text"), ("Params", "integer"), ("Epoch", "timestamp"),
+        ("Open", "float8"), ("High", "float8"), ("Low", "float8"), ("Close", "float8"),
+        ("Volume", "float8"), ("Trades", "float8"),
+    ],
+    "emd": [
+        ("Instrument", "bigint"), ("Resolution", "text"), ("Params", "integer"), ("Epoch", "timestamp"),
+    ] + [(f"{name}_{i}", "float8") for name in ("Imf", "If", "Ia", "Ip") for i in range(16)],
+    "emd_compact": [
+        ("Instrument", "bigint"), ("Resolution", "text"), ("Params", "integer"), ("Epoch", "timestamp"),
+        ("Imf", "float4[]"), ("If", "float4[]"), ("Ia", "float4[]"), ("Ip", "float4[]"),
+    ],
+    "premium_index": [
+        ("SpotInstrument", "bigint"), ("FuturesInstrument", "bigint"), ("Resolution", "text"),
+        ("Epoch", "timestamp"), ("PremiumIndex", "float8"),
+    ],
+}
+
+def staged_value(name: str, type: str) -> str:
+    """
+    Expression selecting a staging column as the type of the table column
+    """
+    if name == "Resolution":
+        return "Resolution::RESOLUTION"
+    if type == "float8":
+        return f"{name}::text::NUMERIC"
+    return name
+
+
+def merge_query(table: str, staging: str, delta: bool, target: Optional[str] = None) -> str:
+    """
+    INSERT ... SELECT from the staging table with the same ON CONFLICT update as
+    the synchronous upserts. With delta, unchanged rows are left untouched.
+    target is the partition of table to write into, by default table itself.
+    """
+    target = target or table
+    names = [name for name, _ in STAGING_COLUMNS[table]]
+    keys = CONFLICT_KEYS[table]
+    updated = [name for name in names if name not in keys]
+    select = ", ".join(staged_value(name, type) for name, type in STAGING_COLUMNS[table])
+    query = (
+        f"INSERT INTO {target} ({', '.join(names)})\n"
+        f"SELECT {select} FROM {staging}\n"
+        f"ON CONFLICT ({', '.join(keys)})\n"
+        f"DO UPDATE SET\n" + ",\n".join(f"{name} = EXCLUDED.{name}" for name in updated)
+    )
+    if delta:
+        query += "\n" + delta_clause(table, target)
+    return query + ";\n"
+
+
+def _naive_utc(epoch: datetime) -> datetime:
+    # Epoch列はTIMESTAMP (タイムゾーンなし, UTC)
+    if epoch.tzinfo is None:
+        return epoch
+    return epoch.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 class Connection:
     """
     Connection class to connect to the Postgres database
     """
 
-    def __init__(self):
+    def __init__(self, delta_tables: Optional[Set[str]] = None, partitioned_tables: Optional[Set[str]] = None):
         self.conn = None
+        self.pool: Optional[asyncpg.Pool] = None
+        if delta_tables is None:
+            delta_tables = {t.strip() for t in os.getenv("PG_DELTA_TABLES", "ohlcvt,ffd,emd,premium_index").split(",") if t.strip()}
+        self.delta_tables = delta_tables
+        if partitioned_tables is None:
+            partitioned_tables = {t.strip() for t in os.getenv("PG_PARTITIONED_TABLES", ",".join(PARTITIONED_TABLES)).split(",") if t.strip()}
+        self.partitioned_tables = partitioned_tables
+        self._partitions: Set[str] = set()
 
     async def connect_to_db(self) -> asyncpg.Connection:
         """
@@ -107,6 +191,85 @@ class Connection:
 
         logging.info("Connected to Postgres")
 
+    async def open_pool(self, min_size: Optional[int] = None, max_size: Optional[int] = None) -> asyncpg.Pool:
+        """
+        Opens the asyncpg pool used by send_rows (PG_POOL_MIN..PG_POOL_MAX connections)
+        """
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                user=os.getenv("POSTGRES_USER"),
+                password=os.getenv("POSTGRES_PASSWORD"),
+                database=os.getenv("POSTGRES_DB"),
+                host=os.getenv("POSTGRES_HOSTNAME"),
+                port=os.getenv("POSTGRES_PORT"),
+                min_size=min_size or int(os.getenv("PG_POOL_MIN", "1")),
+                max_size=max_size or int(os.getenv("PG_POOL_MAX", "8")),
+            )
+            logging.info("Opened an asyncpg pool")
+        return self.pool
+
+    async def close_pool(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def send_rows(self, rows: List[tuple], table: str) -> int:
+        """
+        Upserts rows laid out like the synchronous connector (ohlcvt, ffd, emd,
+        emd_compact, premium_index): binary COPY into a staging table dropped at commit, then
+        one merge, in a single transaction. Rows of partitioned tables are grouped by
+        month and merged straight into their partition. Returns the number of rows written.
+        """
+        if table not in STAGING_COLUMNS:
+            raise ValueError(f"Table {table} not supported")
+        if not rows:
+            return 0
+        columns = STAGING_COLUMNS[table]
+        names = [name for name, _ in columns]
+        epoch = names.index("Epoch")
+        records = [(*row[:epoch], _naive_utc(row[epoch]), *row[epoch + 1:]) for row in rows]
+        delta = table in self.delta_tables
+
+        start = time.time()
+        pool = await self.open_pool()
+        if table in self.partitioned_tables:
+            groups = group_by_month(records, epoch)
+            targets = await self.ensure_partitions(pool, table, list(groups))
+            batches = [(targets[month], group) for month, group in sorted(groups.items())]
+        else:
+            batches = [(table, records)]
+
+        written = 0
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                for target, batch in batches:
+                    staging = f"staging_{target}"
+                    await conn.execute(
+                        f"CREATE TEMP TABLE {staging} ({', '.join(f'{n} {t}' for n, t in columns)}) ON COMMIT DROP;"
+                    )
+                    await conn.copy_records_to_table(staging, records=batch, columns=[n.lower() for n in names])
+                    status = await conn.execute(merge_query(table, staging, delta, target))
+                    written += int(status.split()[-1])  # "INSERT 0 <rows>"
+        elapsed = time.time() - start
+        skipped = f", skipped {len(rows) - written} unchanged" if delta else ""
+        partitions = f" ({len(batches)} partitions)" if table in self.partitioned_tables else ""
+        logging.info(f"Upserted {written}/{len(rows)} rows into {table}{partitions} by binary copy in {elapsed:.3f}s ({len(rows) / max(elapsed, 1e-9):.0f} rows/s{skipped})")
+        return written
+
+    async def ensure_partitions(self, pool: asyncpg.Pool, table: str, months: List[date]) -> Dict[date, str]:
+        """
+        Creates the monthly partitions of table that do not exist yet, before and
+        outside the write transaction. Returns the partition of every month.
+        """
+        targets = {month: partition_name(table, month) for month in months}
+        missing = sorted(month for month, name in targets.items() if name not in self._partitions)
+        if missing:
+            async with pool.acquire() as conn:
+                for month in missing:
+                    await conn.execute("SELECT create_month_partition($1, $2);", table, month)
+            self._partitions.update(targets[month] for month in missing)
+        return targets
+
     async def send(self, data: List, table: str) -> None:
         """
         Upserts OHLCV data into the Postgres database
@@ -161,3 +324,72 @@ class Connection:
             return await self.conn.fetch(
                 f"SELECT * FROM {target} WHERE instrument = {instrument_id} and vpin = {vpin_id} ORDER BY Epoch ASC"
             )
+
+
+class AsyncWriter:
+    """
+    Runs a pooled async Connection on an event loop in a background thread, so
+    synchronous tasks can hand their rows off and go on computing while the
+    upload runs. Writes are tagged (e.g. with the flow run) and flush(tag)
+    waits for the writes of that tag and raises the first failure.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="pg-async-writer", daemon=True)
+        self.thread.start()
+        self.connection = Connection()
+        asyncio.run_coroutine_threadsafe(self.connection.open_pool(), self.loop).result()
+        self._pending: Dict[str, List[Future]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, rows: List[tuple], table: str, tag: str = "") -> Future:
+        """
+        Schedules the upsert and returns at once
+        """
+        future = asyncio.run_coroutine_threadsafe(self.connection.send_rows(rows, table), self.loop)
+        with self._lock:
+            self._pending.setdefault(tag, []).append(future)
+        return future
+
+    def flush(self, tag: str = "") -> int:
+        """
+        Waits for every write submitted with tag; returns the number of rows written
+        """
+        with self._lock:
+            futures = self._pending.pop(tag, [])
+        written, error = 0, None
+        for future in futures:
+            try:
+                written += future.result()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return written
+
+    def discard(self, tag: str = "") -> int:
+        """
+        Forgets the writes of tag without waiting, cancelling those not started
+        yet (e.g. when the flow that submitted them failed); returns their number
+        """
+        with self._lock:
+            futures = self._pending.pop(tag, [])
+        for future in futures:
+            future.cancel()
+        return len(futures)
+
+
+_writer: Optional[AsyncWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_async_writer() -> AsyncWriter:
+    """
+    Returns the background writer of the process, starting it on first use
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AsyncWriter()
+        return _writer
@@ -2,12 +2,23 @@
 # This file contains the functions to connect to the Postgres database
 #
 
+import io
 import os
+import csv
+import time
 import logging
+import threading
 import psycopg2
-from psycopg2  import extras
-from typing import List
+import numpy as np
+import pandas as pd
+from psycopg2  import extras, pool
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set
+from datetime import date, datetime
 from dataclasses import astuple
+from util.types import emd_columns
+from util.partition import PARTITIONED_TABLES, group_by_month, partition_name, partition_month
+from util.upsert import delta_clause
 
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
@@ -26,9 +37,9 @@ Trades = EXCLUDED.Trades;
 """
 
 UPSERT_FFD_QUERY = """
-INSERT INTO ffd (Instrument, Resolution, Fdim, Epoch, Open, High, Low, Close, Volume, Trades)
+INSERT INTO ffd (Instrument, Resolution, Params, Epoch, Open, High, Low, Close, Volume, Trades)
 VALUES %s
-ON CONFLICT (Instrument, Resolution, Fdim, Epoch)
+ON CONFLICT (Instrument, Resolution, Params, Epoch)
 DO UPDATE SET
 Open = EXCLUDED.Open,
 High = EXCLUDED.High,
@@ -39,9 +50,9 @@ Trades = EXCLUDED.Trades;
 """
 
 UPSERT_EMD_QUERY = """
-INSERT INTO emd (Instrument, Resolution, Fdim, Epoch, Imf_0, Imf_1, Imf_2, Imf_3, Imf_4, Imf_5, Imf_6, Imf_7, Imf_8, Imf_9, Imf_10, Imf_11, Imf_12, Imf_13, Imf_14, Imf_15, If_0, If_1, If_2, If_3, If_4, If_5, If_6, If_7, If_8, If_9, If_10, If_11, If_12, If_13, If_14, If_15, Ia_0, Ia_1, Ia_2, Ia_3, Ia_4, Ia_5, Ia_6, Ia_7, Ia_8, Ia_9, Ia_10, Ia_11, Ia_12, Ia_13, Ia_14, Ia_15, Ip_0, Ip_1, Ip_2, Ip_3, Ip_4, Ip_5, Ip_6, Ip_7, Ip_8, Ip_9, Ip_10, Ip_11, Ip_12, Ip_13, Ip_14, Ip_15)
+INSERT INTO emd (Instrument, Resolution, Params, Epoch, Imf_0, Imf_1, Imf_2, Imf_3, Imf_4, Imf_5, Imf_6, Imf_7, Imf_8, Imf_9, Imf_10, Imf_11, Imf_12, Imf_13, Imf_14, Imf_15, If_0, If_1, If_2, If_3, If_4, If_5, If_6, If_7, If_8, If_9, If_10, If_11, If_12, If_13, If_14, If_15, Ia_0, Ia_1, Ia_2, Ia_3, Ia_4, Ia_5, Ia_6, Ia_7, Ia_8, Ia_9, Ia_10, Ia_11, Ia_12, Ia_13, Ia_14, Ia_15, Ip_0, Ip_1, Ip_2, Ip_3, Ip_4, Ip_5, Ip_6, Ip_7, Ip_8, Ip_9, Ip_10, Ip_11, Ip_12, Ip_13, Ip_14, Ip_15)
 VALUES %s
-ON CONFLICT (Instrument, Resolution, Fdim, Epoch)
+ON CONFLICT (Instrument, Resolution, Params, Epoch)
 DO UPDATE SET
 Imf_0 = EXCLUDED.Imf_0,
 Imf_1 = EXCLUDED.Imf_1,
@@ -109,6 +120,17 @@ Ip_14 = EXCLUDED.Ip_14,
 Ip_15 = EXCLUDED.Ip_15;
 """
 
+UPSERT_EMD_COMPACT_QUERY = """
+INSERT INTO emd_compact (Instrument, Resolution, Params, Epoch, Imf, If, Ia, Ip)
+VALUES %s
+ON CONFLICT (Instrument, Resolution, Params, Epoch)
+DO UPDATE SET
+Imf = EXCLUDED.Imf,
+If = EXCLUDED.If,
+Ia = EXCLUDED.Ia,
+Ip = EXCLUDED.Ip;
+"""
+
 UPSERT_PREMIUM_INDEX_QUERY = """
 INSERT INTO premium_index (SpotInstrument, FuturesInstrument, Resolution, Epoch, PremiumIndex)
 VALUES %s
@@ -161,20 +183,125 @@ Bid = EXCLUDED.Bid,
 Last = EXCLUDED.Last;
 """
 
+FETCH_OHLCVT_WINDOW_QUERY = """
+SELECT Epoch, Open::float8, High::float8, Low::float8, Close::float8, Volume::float8, Trades
+FROM ohlcvt
+WHERE Instrument = %(instrument)s
+AND Epoch >= (SELECT Epoch FROM ohlcvt WHERE Instrument = %(instrument)s ORDER BY Epoch DESC LIMIT 1) - %(seconds)s * INTERVAL '1 second'
+ORDER BY Epoch ASC;
+"""
+
+FETCH_OHLCVT_SINCE_QUERY = """
+SELECT Epoch, Open::float8, High::float8, Low::float8, Close::float8, Volume::float8, Trades
+FROM ohlcvt
+WHERE Instrument = %(instrument)s
+AND Epoch >= %(since)s
+ORDER BY Epoch ASC;
+"""
+
+OHLCVT_WINDOW_COLUMNS = ["Open", "High", "Low", "Close", "Volume", "Trades"]
+
+EMD_COLUMNS = emd_columns()
+
+FETCH_EMD_SINCE_QUERY = f"""
+SELECT Epoch, {", ".join(f"{c}::float8" for c in EMD_COLUMNS)}
+FROM emd
+WHERE Instrument = %(instrument)s
+AND Resolution = %(resolution)s
+AND Params = %(params)s
+AND Epoch >= %(since)s
+ORDER BY Epoch ASC;
+"""
+
+FETCH_PARAMS_QUERY = """
+SELECT id FROM feature_params
+WHERE Fdim = %(fdim)s AND Thresh = %(thresh)s AND MaxImfs = %(max_imfs)s;
+"""
+
+# 既にある組で id の連番を消費しないよう、FETCH_PARAMS_QUERYで見つからない時だけ実行する
+REGISTER_PARAMS_QUERY = """
+INSERT INTO feature_params (Fdim, Thresh, MaxImfs)
+VALUES (%(fdim)s, %(thresh)s, %(max_imfs)s)
+ON CONFLICT (Fdim, Thresh, MaxImfs) DO NOTHING
+RETURNING id;
+"""
+
+FETCH_EMD_COMPACT_SINCE_QUERY = """
+SELECT Epoch, Imf, If, Ia, Ip
+FROM emd_compact
+WHERE Instrument = %(instrument)s
+AND Resolution = %(resolution)s
+AND Params = %(params)s
+AND Epoch >= %(since)s
+ORDER BY Epoch ASC;
+"""
+
+
+def delta_query(query: str, table: str, target: Optional[str] = None) -> str:
+    """
+    Turns the upsert query of table into one that leaves rows whose updated columns
+    are all unchanged untouched (no new tuple, WAL or index entry) and returns one
+    row per inserted or updated row. The columns come from util.upsert, not from
+    the query text. target is the partition written, by default table.
+    """
+    return f"{query.strip().rstrip(';')}\n{delta_clause(table, target)}\nRETURNING 1;\n"
+
 
 class Connection:
     """
     Connection class to connect to the Postgres database
+
+    Rows are upserted either with execute_values ("values") or by streaming them
+    with COPY into a temporary staging table merged with one INSERT ... SELECT
+    ("copy"). The tables written with COPY are listed in PG_COPY_TABLES.
+    For the tables in PG_DELTA_TABLES, conflicting rows whose values did not
+    change are skipped instead of being rewritten.
+
+    The tables in PG_PARTITIONED_TABLES are partitioned by month of Epoch: rows
+    are grouped by month and each group is upserted straight into its partition,
+    which is created first if it does not exist yet.
+
+    Connections come from a thread-safe pool of PG_POOL_MIN..PG_POOL_MAX
+    connections shared by all tasks; callers beyond PG_POOL_MAX wait for a free
+    one. A connection idle for more than PG_POOL_CHECK_SECONDS is checked with
+    SELECT 1 before it is handed out and replaced if it is broken.
     """
 
-    def __init__(self):
-        self.conn = None
+    def __init__(
+        self,
+        copy_tables: Optional[Set[str]] = None,
+        delta_tables: Optional[Set[str]] = None,
+        minconn: Optional[int] = None,
+        maxconn: Optional[int] = None,
+        partitioned_tables: Optional[Set[str]] = None,
+    ):
+        self.minconn = minconn or int(os.getenv("PG_POOL_MIN", "1"))
+        self.maxconn = maxconn or int(os.getenv("PG_POOL_MAX", "8"))
+        self.check_seconds = float(os.getenv("PG_POOL_CHECK_SECONDS", "30"))
+        self.pool: Optional[pool.ThreadedConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._last_used: Dict[int, float] = {}
+        if copy_tables is None:
+            copy_tables = {t.strip() for t in os.getenv("PG_COPY_TABLES", "emd").split(",") if t.strip()}
+        self.copy_tables = copy_tables
+        if delta_tables is None:
+            delta_tables = {t.strip() for t in os.getenv("PG_DELTA_TABLES", "ohlcvt,ffd,emd,premium_index").split(",") if t.strip()}
+        self.delta_tables = delta_tables
+        if partitioned_tables is None:
+            partitioned_tables = {t.strip() for t in os.getenv("PG_PARTITIONED_TABLES", ",".join(PARTITIONED_TABLES)).split(",") if t.strip()}
+        self.partitioned_tables = partitioned_tables
+        self._partitions: Set[str] = set()
+        self._params: Dict[tuple, int] = {}
 
     def connect_to_db(self):
         """
         Connects to the Postgres database
         """
-        return psycopg2.connect(
+        return psycopg2.connect(**self._dsn())
+
+    def _dsn(self) -> dict:
+        return dict(
             user=os.getenv("POSTGRES_USER"),
             password=os.getenv("POSTGRES_PASSWORD"),
             database=os.getenv("POSTGRES_DB"),
@@ -182,11 +309,62 @@ class Connection:
             port=os.getenv("POSTGRES_PORT"),
         )
 
+    def _get_pool(self) -> pool.ThreadedConnectionPool:
+        with self._pool_lock:
+            if self.pool is None or self.pool.closed:
+                self.pool = pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self._dsn())
+                logging.info(f"Opened a Postgres pool of {self.minconn}..{self.maxconn} connections")
+            return self.pool
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if time.time() - self._last_used.get(id(conn), 0.0) < self.check_seconds:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    @contextmanager
+    def conn(self) -> Iterator:
+        """
+        Borrows a pooled connection for one transaction: commits when the block
+        succeeds, rolls back when it raises, then returns the connection to the pool
+        """
+        with self._slots:
+            p = self._get_pool()
+            conn = p.getconn()
+            if not self._healthy(conn):
+                logging.info("Replacing a broken Postgres connection")
+                p.putconn(conn, close=True)
+                conn = p.getconn()
+            broken = False
+            try:
+                with conn:
+                    yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                self._last_used[id(conn)] = time.time()
+                p.putconn(conn, close=broken or bool(conn.closed))
+
+    def close(self) -> None:
+        """
+        Closes every pooled connection
+        """
+        with self._pool_lock:
+            if self.pool is not None and not self.pool.closed:
+                self.pool.closeall()
+
     def connection_test(self):
         """
         Tests the connection to the Postgres database
         """
-        self.conn = self.connect_to_db
         try:
             with self.conn() as conn:
                 with conn.cursor() as cursor:
@@ -201,7 +379,15 @@ class Connection:
         """
         Upserts OHLCV data into the Postgres database
         """
-        logging.debug(f"Inserting {len(data)} rows into Postgres")
+        self.send_rows([astuple(d) for d in data], table)
+
+    def send_rows(self, rows: List[tuple], table: str, mode: Optional[str] = None, delta: Optional[bool] = None) -> None:
+        """
+        Upserts rows already laid out in the column order of the table.
+        mode is "values" or "copy"; by default "copy" for the tables in copy_tables.
+        delta skips unchanged rows; by default for the tables in delta_tables.
+        """
+        logging.debug(f"Inserting {len(rows)} rows into Postgres")
         match table:
             case "ohlcvt":
                 query = UPSERT_OHLCVT_QUERY
@@ -209,15 +395,136 @@ class Connection:
                 query = UPSERT_FFD_QUERY
             case "emd":
                 query = UPSERT_EMD_QUERY
+            case "emd_compact":
+                query = UPSERT_EMD_COMPACT_QUERY
             case "premium_index":
                 query = UPSERT_PREMIUM_INDEX_QUERY
             # case "features_202406":
             #     query = UPSERT_FEATURES_202406_QUERY
             case _:
                 raise ValueError(f"Table {table} not supported")
+        if not rows:
+            return
+        mode = mode or ("copy" if table in self.copy_tables else "values")
+        delta = table in self.delta_tables if delta is None else delta
+        if mode not in ("copy", "values"):
+            raise ValueError(f"Write mode {mode} not supported")
+
+        if table in self.partitioned_tables:
+            columns = [c.strip() for c in query[query.index("(") + 1:query.index(")")].split(",")]
+            groups = group_by_month(rows, columns.index("Epoch"))
+            targets = self.ensure_partitions(table, list(groups))
+            batches = [(targets[month], group) for month, group in sorted(groups.items())]
+        else:
+            batches = [(table, rows)]
+
+        start = time.time()
+        written = 0
         with self.conn() as conn:
             with conn.cursor() as cursor:
-                extras.execute_values(cursor, query, [astuple(d) for d in data])
+                for target, batch in batches:
+                    q = query.replace(f"INSERT INTO {table} (", f"INSERT INTO {target} (")
+                    if delta:
+                        q = delta_query(q, table, target)
+                    if mode == "copy":
+                        written += self._copy_upsert(cursor, target, q, batch)
+                    else:
+                        written += len(extras.execute_values(cursor, q, batch, fetch=delta)) if delta else len(batch)
+        elapsed = time.time() - start
+        skipped = f", skipped {len(rows) - written} unchanged" if delta else ""
+        partitions = f" ({len(batches)} partitions)" if table in self.partitioned_tables else ""
+        logging.info(f"Upserted {written}/{len(rows)} rows into {table}{partitions} by {mode} in {elapsed:.3f}s ({len(rows) / max(elapsed, 1e-9):.0f} rows/s{skipped})")
+
+    def register_params(self, fdim: float, thresh: float, max_imfs: int) -> int:
+        """
+        Returns the id of (fdim, thresh, max_imfs) in feature_params, registering the
+        set on first use. Ids never change, so they are cached for the process.
+        """
+        key = (fdim, thresh, max_imfs)
+        if key not in self._params:
+            params = {"fdim": fdim, "thresh": thresh, "max_imfs": max_imfs}
+            with self.conn() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(FETCH_PARAMS_QUERY, params)
+                    row = cursor.fetchone()
+                    if row is None:
+                        cursor.execute(REGISTER_PARAMS_QUERY, params)
+                        row = cursor.fetchone()
+                    if row is None:
+                        # 同時に別のプロセスが登録した
+                        cursor.execute(FETCH_PARAMS_QUERY, params)
+                        row = cursor.fetchone()
+            self._params[key] = row[0]
+        return self._params[key]
+
+    def ensure_partitions(self, table: str, months: List[date]) -> Dict[date, str]:
+        """
+        Creates the monthly partitions of table that do not exist yet, in a short
+        transaction of its own so the lock on the parent is released before the
+        rows are written. Returns the partition of every month.
+        """
+        targets = {month: partition_name(table, month) for month in months}
+        missing = sorted(month for month, name in targets.items() if name not in self._partitions)
+        if missing:
+            with self.conn() as conn:
+                with conn.cursor() as cursor:
+                    for month in missing:
+                        cursor.execute("SELECT create_month_partition(%s, %s);", (table, month))
+            self._partitions.update(targets[month] for month in missing)
+        return targets
+
+    def drop_partitions_before(self, table: str, before: date) -> List[str]:
+        """
+        Detaches and drops the partitions of table for the months before `before`.
+        Dropping a partition frees its files at once, unlike DELETE which leaves
+        dead tuples for vacuum. Returns the dropped partitions. Raises ValueError
+        for a table not in PARTITIONED_TABLES, as the names go into the DDL as is.
+        """
+        if table not in PARTITIONED_TABLES:
+            raise ValueError(f"Table {table} is not partitioned")
+        with self.conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass ORDER BY c.relname;",
+                    (table,),
+                )
+                names = [row[0] for row in cursor.fetchall()]
+
+        dropped = []
+        for name in names:
+            month = partition_month(name)
+            # Only partitions named by create_month_partition are dropped
+            if month is None or month >= before or name != partition_name(table, month):
+                continue
+            with self.conn() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name};")
+                    cursor.execute(f"DROP TABLE {name};")
+            self._partitions.discard(name)
+            dropped.append(name)
+            logging.info(f"Dropped partition {name} of {table}")
+        return dropped
+
+    def _copy_upsert(self, cursor, table: str, query: str, rows: List[tuple]) -> int:
+        """
+        Streams rows as CSV into a staging table dropped at commit, then merges it
+        into the table (or partition) with the ON CONFLICT clause of the upsert query,
+        all within the transaction of the cursor. Returns the number of rows inserted or updated
+        """
+        columns = query[query.index("(") + 1:query.index(")")]
+        staging = f"staging_{table}"
+        cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;")
+
+        # NoneはCSVの空フィールド、つまりNULLになる。リストは配列リテラルにする
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            writer.writerow([f"{{{','.join(map(str, v))}}}" if isinstance(v, list) else v for v in row])
+        buf.seek(0)
+        cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+
+        cursor.execute(query.replace("VALUES %s", f"SELECT {columns} FROM {staging}"))
+        return cursor.rowcount
 
     def fetch(
         self, target: str, source: str, instrument_id: str, vpin_id: str
@@ -259,3 +566,136 @@ class Connection:
             with conn.cursor() as cursor:
                 cursor.execute(f"SELECT * FROM {target} WHERE instrument = {instrument_id} ORDER BY Epoch ASC;")
                 return cursor.fetchall()
+
+    def fetch_last_epoch(self, target: str, instrument_id: int) -> Optional[datetime]:
+        """
+        Fetches the latest Epoch stored for the instrument, or None if it has no rows
+        """
+        with self.conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT Epoch FROM {target} WHERE Instrument = %s ORDER BY Epoch DESC LIMIT 1;",
+                    (instrument_id,),
+                )
+                row = cursor.fetchone()
+                return row[0] if row else None
+
+    def fetch_ohlcvt_window(
+        self, instrument_id: int, window_seconds: int, chunk_size: int = 50000
+    ) -> pd.DataFrame:
+        """
+        Fetches the trailing window_seconds of ohlcvt for the instrument as a float DataFrame
+        """
+        return self._stream_ohlcvt(
+            FETCH_OHLCVT_WINDOW_QUERY,
+            {"instrument": instrument_id, "seconds": window_seconds},
+            f"ohlcvt_window_{instrument_id}",
+            chunk_size,
+        )
+
+    def fetch_ohlcvt_since(
+        self, instrument_id: int, since: datetime, chunk_size: int = 50000
+    ) -> pd.DataFrame:
+        """
+        Fetches ohlcvt rows of the instrument with Epoch >= since as a float DataFrame
+        """
+        return self._stream_ohlcvt(
+            FETCH_OHLCVT_SINCE_QUERY,
+            {"instrument": instrument_id, "since": since},
+            f"ohlcvt_since_{instrument_id}",
+            chunk_size,
+        )
+
+    def _stream_ohlcvt(self, query: str, params: dict, cursor_name: str, chunk_size: int) -> pd.DataFrame:
+        """
+        Rows are streamed through a server-side cursor in chunks of chunk_size and
+        collected into column arrays, so only one chunk of tuples is alive at a time.
+        """
+        epochs, values = [], []
+        with self.conn() as conn:
+            with conn.cursor(name=cursor_name) as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    cols = list(zip(*rows))
+                    epochs.append(np.array(cols[0], dtype="datetime64[us]"))
+                    values.append(np.array(cols[1:], dtype=np.float64))
+
+        if not epochs:
+            return pd.DataFrame(columns=OHLCVT_WINDOW_COLUMNS, index=pd.DatetimeIndex([], name="Epoch"))
+
+        block = np.concatenate(values, axis=1)
+        df = pd.DataFrame(
+            {name: block[i] for i, name in enumerate(OHLCVT_WINDOW_COLUMNS)},
+            index=pd.DatetimeIndex(np.concatenate(epochs), name="Epoch"),
+        )
+        df["Trades"] = df["Trades"].astype(np.int64)
+        return df
+
+    def fetch_emd_since(
+        self, instrument_id: int, resolution: str, params_id: int, since: datetime
+    ) -> pd.DataFrame:
+        """
+        Fetches emd rows with Epoch >= since as a float DataFrame (NULL as NaN)
+        """
+        with self.conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    FETCH_EMD_SINCE_QUERY,
+                    {"instrument": instrument_id, "resolution": resolution, "params": params_id, "since": since},
+                )
+                rows = cursor.fetchall()
+
+        if not rows:
+            return pd.DataFrame(columns=EMD_COLUMNS, index=pd.DatetimeIndex([], name="Epoch"), dtype=np.float64)
+
+        cols = list(zip(*rows))
+        return pd.DataFrame(
+            np.array(cols[1:], dtype=np.float64).T,
+            index=pd.DatetimeIndex(np.array(cols[0], dtype="datetime64[us]"), name="Epoch"),
+            columns=EMD_COLUMNS,
+        )
+
+    def fetch_emd_compact_since(
+        self, instrument_id: int, resolution: str, params_id: int, since: datetime
+    ) -> pd.DataFrame:
+        """
+        Fetches emd_compact rows with Epoch >= since as an EMD block (columns of
+        emd_columns for the longest array, NaN for IMFs a row does not have)
+        """
+        with self.conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    FETCH_EMD_COMPACT_SINCE_QUERY,
+                    {"instrument": instrument_id, "resolution": resolution, "params": params_id, "since": since},
+                )
+                rows = cursor.fetchall()
+
+        max_imfs = max((len(row[1]) for row in rows), default=0)
+        block = np.full((len(rows), 4 * max_imfs), np.nan)
+        for i, row in enumerate(rows):
+            for k, values in enumerate(row[1:]):
+                block[i, k * max_imfs:k * max_imfs + len(values)] = values
+        return pd.DataFrame(
+            block,
+            index=pd.DatetimeIndex(np.array([row[0] for row in rows], dtype="datetime64[us]"), name="Epoch"),
+            columns=emd_columns(max_imfs),
+        )
+
+
+_connection: Optional[Connection] = None
+_connection_lock = threading.Lock()
+
+
+def get_connection() -> Connection:
+    """
+    Returns the pooled Postgres connector of the process, creating it on first use
+    """
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            _connection = Connection()
+        return _connection
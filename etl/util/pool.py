@@ -0,0 +1,185 @@
+# Process Pool
+# Persistent worker processes for the CPU-bound feature computations
+#
+
+import os
+import logging
+import threading
+import multiprocessing
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional, Tuple
+
+from util.types import emd_columns
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+# (shared memory name, shape, dtype) of an array handed to or from a worker
+Handle = Tuple[str, Tuple[int, ...], str]
+
+
+def _share(shape: Tuple[int, ...], dtype, data: Optional[np.ndarray] = None) -> Tuple[shared_memory.SharedMemory, Handle]:
+    dtype = np.dtype(dtype)
+    # サイズ0のSharedMemoryは作れないので最低1バイト確保する
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    if data is not None:
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf)[...] = data
+    return shm, (shm.name, tuple(shape), dtype.str)
+
+
+def _call(fn: Callable, inputs: Dict[str, Handle], outputs: Dict[str, Handle], kwargs: dict) -> None:
+    """
+    Runs in the worker: attaches the shared arrays and lets fn read `inputs` and fill `outputs`
+    """
+    segments, arrays = [], {}
+    try:
+        for key, (name, shape, dtype) in {**inputs, **outputs}.items():
+            shm = shared_memory.SharedMemory(name=name)
+            segments.append(shm)
+            arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        fn({k: arrays[k] for k in inputs}, {k: arrays[k] for k in outputs}, **kwargs)
+    finally:
+        arrays.clear()
+        for shm in segments:
+            shm.close()
+
+
+class ProcessPool:
+    """
+    Process pool shared by every flow of the process.
+
+    Arrays are passed through shared memory: the caller copies the inputs into
+    segments once, the worker attaches them and writes its results into output
+    segments allocated by the caller, so no DataFrame is pickled either way.
+    Workers are started with the "spawn" method so they do not inherit the
+    threads and connections of the server. When a worker dies (e.g. killed by the
+    OOM killer) the call fails with BrokenProcessPool and the workers are replaced,
+    so later calls do not keep failing.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or int(os.getenv("ETL_PROCESS_WORKERS", str(os.cpu_count() or 1)))
+        self.executor = self._start()
+        self._lock = threading.Lock()
+
+    def _start(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Starts new workers in place of a broken executor, once per breakage
+        """
+        with self._lock:
+            if self.executor is not broken:
+                return
+            self.executor = self._start()
+        broken.shutdown(wait=False)
+        logging.warning(f"A worker of the process pool died; restarted {self.max_workers} workers")
+
+    def run(self, fn: Callable, inputs: Dict[str, np.ndarray], outputs: Dict[str, Tuple[Tuple[int, ...], str]], **kwargs) -> Dict[str, np.ndarray]:
+        """
+        Runs fn(inputs, outputs, **kwargs) in a worker and returns copies of the outputs.
+        fn must be a module-level function; `outputs` maps names to (shape, dtype).
+        """
+        segments = []
+        try:
+            in_handles, out_handles, out_arrays = {}, {}, {}
+            for key, arr in inputs.items():
+                arr = np.ascontiguousarray(arr)
+                shm, in_handles[key] = _share(arr.shape, arr.dtype, arr)
+                segments.append(shm)
+            for key, (shape, dtype) in outputs.items():
+                shm, out_handles[key] = _share(shape, dtype)
+                segments.append(shm)
+                out_arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+            executor = self.executor
+            try:
+                executor.submit(_call, fn, in_handles, out_handles, kwargs).result()
+            except BrokenProcessPool:
+                self._replace(executor)
+                raise
+            return {key: arr.copy() for key, arr in out_arrays.items()}
+        finally:
+            out_arrays.clear()
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+_pool: Optional[ProcessPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPool:
+    """
+    Returns the process pool of the process, starting the workers on first use
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPool()
+            logging.info(f"Started a process pool of {_pool.max_workers} workers")
+        return _pool
+
+
+def _ffd_emd(inputs: Dict[str, np.ndarray], outputs: Dict[str, np.ndarray], fdim: float, thresh: float, max_imfs: int) -> None:
+    """
+    Worker side of ffd_emd: FFD of every column, then EMD of the FFD Close over the
+    rows left after dropping NaN (same rows and sample rate as calc_emd)
+    """
+    import emd
+    from util.ffd import frac_diff_ffd
+
+    ohlcvt, epochs = inputs["ohlcvt"], inputs["epochs"]
+    ffd = frac_diff_ffd(pd.DataFrame(ohlcvt), fdim, thresh).to_numpy()
+    outputs["ffd"][...] = ffd
+
+    rows = np.flatnonzero(~np.isnan(ffd).any(axis=1))
+    outputs["rows"][...] = -1
+    outputs["rows"][:len(rows)] = rows
+    if len(rows) == 0:
+        return
+
+    imfs = emd.sift.sift(ffd[rows, 3], max_imfs=max_imfs)
+    span = pd.Timedelta(int(epochs[rows[-1]] - epochs[rows[0]]), unit="ns")
+    sample_rate = len(rows) / span.seconds
+    IP, IF, IA = emd.spectra.frequency_transform(imfs, sample_rate, 'nht')
+
+    n = min(imfs.shape[1], max_imfs)
+    block = outputs["emd"]
+    block[...] = np.nan
+    for k, values in enumerate([imfs, IF, IA, IP]):
+        block[:len(rows), k * max_imfs:k * max_imfs + n] = values[:, :n]
+
+
+def ffd_emd(df: pd.DataFrame, fdim: float, thresh: float, max_imfs: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Computes FFD of the OHLCVT columns of df and the EMD of its Close in a pool worker.
+    Returns the same (ffd_df, emd_df) as frac_diff_ffd(...).dropna() and calc_emd(ffd_df).
+    """
+    n = len(df)
+    epochs = df.index.values.astype("datetime64[ns]").view(np.int64)
+    out = get_process_pool().run(
+        _ffd_emd,
+        {"ohlcvt": df.to_numpy(dtype=np.float64), "epochs": epochs},
+        {
+            "ffd": ((n, df.shape[1]), "f8"),
+            "rows": ((n,), "i8"),
+            "emd": ((n, 4 * max_imfs), "f8"),
+        },
+        fdim=fdim, thresh=thresh, max_imfs=max_imfs,
+    )
+
+    rows = out["rows"][out["rows"] >= 0]
+    ffd_df = pd.DataFrame(out["ffd"][rows], index=df.index[rows], columns=df.columns)
+
+    emd_df = pd.DataFrame(out["emd"][:len(rows)], index=ffd_df.index, columns=emd_columns(max_imfs))
+    return ffd_df, emd_df
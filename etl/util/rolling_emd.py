@@ -0,0 +1,141 @@
+# Rolling EMD
+# Causal EMD features: every bar is decomposed from the bars up to and including it
+#
+
+import os
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from util.pool import get_process_pool
+from util.types import emd_columns
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+def _rolling_emd(inputs: Dict[str, np.ndarray], outputs: Dict[str, np.ndarray], window: int, max_imfs: int) -> None:
+    """
+    Worker side of RollingEMD: row j of the output block is the last row of the
+    EMD of close[j : j + window], i.e. of the window ending at output bar j
+    """
+    import emd
+
+    close, epochs = inputs["close"], inputs["epochs"]
+    block = outputs["emd"]
+    block[...] = np.nan
+    for j in range(len(block)):
+        x = close[j:j + window]
+        imfs = emd.sift.sift(x, max_imfs=max_imfs)
+        seconds = (epochs[j + window - 1] - epochs[j]) / 1e9
+        IP, IF, IA = emd.spectra.frequency_transform(imfs, window / seconds, 'nht')
+        n = min(imfs.shape[1], max_imfs)
+        for k, values in enumerate([imfs, IF, IA, IP]):
+            block[j, k * max_imfs:k * max_imfs + n] = values[-1, :n]
+
+
+class RollingEMD:
+    """
+    Look-ahead free EMD of one (instrument, resolution, fdim) series for training datasets.
+
+    The value of bar t is taken from the sift of the `window` bars ending at t, so
+    it never depends on later bars. Bars are split into chunks of chunk_ticks that
+    run in parallel on the process pool, each worker receiving the close series of
+    its chunk (plus the preceding window) through shared memory.
+
+    Every finished chunk is written as an Arrow file under
+    {root}/{key}_w{window}_m{max_imfs}/{first_epoch_ns}.arrow as soon as it completes, and bars
+    already present in the directory are skipped, so an interrupted backfill
+    resumes where it stopped. The directory is the dataset: read() loads it. Point
+    ROLLING_EMD_DIR at a persistent volume (docker-compose.yml mounts one), or a
+    restart loses the checkpoints and the backfill starts over.
+    The trailing open_ticks bars may still be forming: they are recomputed on
+    every run and never checkpointed.
+    """
+
+    def __init__(self, key: str, window: int, max_imfs: int, chunk_ticks: int = 2048, root: Optional[str] = None):
+        self.window = window
+        self.max_imfs = max_imfs
+        self.chunk_ticks = chunk_ticks
+        root = root or os.getenv("ROLLING_EMD_DIR", "/tmp/rolling_emd")
+        self.path = os.path.join(root, f"{key}_w{window}_m{max_imfs}")
+
+    def _files(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith(".arrow"))
+
+    def read(self) -> pd.DataFrame:
+        """
+        Loads every checkpointed bar, indexed by Epoch
+        """
+        tables = []
+        for path in self._files():
+            with pa.memory_map(path, "r") as source:
+                tables.append(pa.ipc.open_file(source).read_all())
+        if not tables:
+            return pd.DataFrame(columns=emd_columns(self.max_imfs), index=pd.DatetimeIndex([], tz="UTC", name="Epoch"))
+        df = pa.concat_tables(tables).to_pandas().set_index("Epoch")
+        return df[~df.index.duplicated(keep="last")].sort_index()
+
+    def _write(self, df: pd.DataFrame) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        # read() indexes on the Epoch column whatever the name of the index of close
+        table = pa.Table.from_pandas(df.rename_axis("Epoch").reset_index(), preserve_index=False)
+        dst = os.path.join(self.path, f"{df.index[0].value:020d}.arrow")
+        tmp = dst + ".tmp"
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, dst)
+
+    def run(self, close: pd.Series, open_ticks: int = 1) -> pd.DataFrame:
+        """
+        Computes the bars of close (indexed by a UTC Epoch) not checkpointed yet and
+        returns the rolling EMD of every bar that has a full window. The last
+        open_ticks bars are computed but not checkpointed.
+        """
+        close = close.dropna()
+        if close.index.tz is None:
+            close.index = close.index.tz_localize("UTC")
+        values = close.to_numpy(dtype=np.float64)
+        epochs = close.index.values.astype("datetime64[ns]").view(np.int64)
+
+        done = self.read().index
+        targets = np.arange(self.window - 1, len(close))
+        finished = len(close) - open_ticks
+        open_rows = targets[targets >= finished]
+        targets = targets[(targets < finished) & ~close.index[targets].isin(done)]
+        # 未計算のバーを連続する区間ごとにchunk_ticks本ずつに分ける
+        chunks = []
+        for run in np.split(targets, np.flatnonzero(np.diff(targets) != 1) + 1):
+            chunks += [run[i:i + self.chunk_ticks] for i in range(0, len(run), self.chunk_ticks)]
+        chunks = [c for c in chunks if len(c)]
+
+        pool = get_process_pool()
+        columns = emd_columns(self.max_imfs)
+
+        def compute(rows: np.ndarray) -> pd.DataFrame:
+            lo, hi = rows[0] - (self.window - 1), rows[-1] + 1
+            out = pool.run(
+                _rolling_emd,
+                {"close": values[lo:hi], "epochs": epochs[lo:hi]},
+                {"emd": ((len(rows), len(columns)), "f8")},
+                window=self.window, max_imfs=self.max_imfs,
+            )
+            return pd.DataFrame(out["emd"], index=close.index[rows], columns=columns)
+
+        with ThreadPoolExecutor(max_workers=pool.max_workers) as executor:
+            open_future = executor.submit(compute, open_rows) if len(open_rows) else None
+            futures = [executor.submit(compute, rows) for rows in chunks]
+            for i, future in enumerate(as_completed(futures)):
+                self._write(future.result())
+                logging.info(f"Rolling EMD {os.path.basename(self.path)}: {i + 1}/{len(chunks)} chunks")
+            open_df = open_future.result() if open_future is not None else None
+
+        df = self.read()
+        if open_df is not None:
+            df = pd.concat([df.loc[~df.index.isin(open_df.index)], open_df]).sort_index()
+        return df.reindex(close.index[self.window - 1:])
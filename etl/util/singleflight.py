@@ -0,0 +1,46 @@
+# Single Flight
+# Coalesces concurrent calls with the same key into one execution
+#
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """
+    The first caller of a key runs the function; callers arriving with the same
+    key while it runs wait for it and receive its result (or its exception).
+    The key is forgotten as soon as the call finishes, so nothing is cached.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable, *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        Returns (result, shared) where shared is True when the result came from
+        a call already in flight
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result(), True
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result(), False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
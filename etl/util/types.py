@@ -1,3 +1,4 @@
+from typing import List
 from datetime import datetime
 from dataclasses import dataclass
 
@@ -18,7 +19,7 @@ class OHLCV:
 class FFD:
     Instrument: int
     Resolution: str
-    Fdim: float
+    Params: int
     Epoch: datetime
     Open: float
     High: float
@@ -28,11 +29,20 @@ class FFD:
     Trades: int
 
 
+# Quantities of an EMD row in the column order of the emd table
+EMD_QUANTITIES = ("imf", "if", "ia", "ip")
+
+
+def emd_columns(max_imfs: int = 16) -> List[str]:
+    """Column names of an EMD block (imf_0.., if_0.., ia_0.., ip_0..) in the order of the emd table"""
+    return [f"{name}_{i}" for name in EMD_QUANTITIES for i in range(max_imfs)]
+
+
 @dataclass
 class EMD:
     Instrument: int
     Resolution: str
-    Fdim: float
+    Params: int
     Epoch: datetime
     Imf_0: float
     Imf_1: float
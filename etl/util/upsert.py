@@ -0,0 +1,43 @@
+# Upserts
+# Columns and conflict keys of the tables written by send_rows, shared by the connectors
+#
+
+from typing import Dict, List, Optional
+
+
+# Columns of the tables in the order of the rows built by util.encode
+UPSERT_COLUMNS: Dict[str, List[str]] = {
+    "ohlcvt": ["Instrument", "Epoch", "Open", "High", "Low", "Close", "Volume", "Trades"],
+    "ffd": ["Instrument", "Resolution", "Params", "Epoch", "Open", "High", "Low", "Close", "Volume", "Trades"],
+    "emd": ["Instrument", "Resolution", "Params", "Epoch"]
+    + [f"{name}_{i}" for name in ("Imf", "If", "Ia", "Ip") for i in range(16)],
+    "emd_compact": ["Instrument", "Resolution", "Params", "Epoch", "Imf", "If", "Ia", "Ip"],
+    "premium_index": ["SpotInstrument", "FuturesInstrument", "Resolution", "Epoch", "PremiumIndex"],
+}
+
+CONFLICT_KEYS: Dict[str, List[str]] = {
+    "ohlcvt": ["Instrument", "Epoch"],
+    "ffd": ["Instrument", "Resolution", "Params", "Epoch"],
+    "emd": ["Instrument", "Resolution", "Params", "Epoch"],
+    "emd_compact": ["Instrument", "Resolution", "Params", "Epoch"],
+    "premium_index": ["SpotInstrument", "FuturesInstrument", "Resolution", "Epoch"],
+}
+
+
+def updated_columns(table: str) -> List[str]:
+    """
+    Columns set by the ON CONFLICT update of table, i.e. every column but the conflict keys
+    """
+    return [name for name in UPSERT_COLUMNS[table] if name not in CONFLICT_KEYS[table]]
+
+
+def delta_clause(table: str, target: Optional[str] = None) -> str:
+    """
+    WHERE clause of the ON CONFLICT update that leaves rows whose updated columns
+    are all unchanged untouched. target is the partition written, by default table.
+    """
+    target = target or table
+    updated = updated_columns(table)
+    current = ", ".join(f"{target}.{name}" for name in updated)
+    excluded = ", ".join(f"EXCLUDED.{name}" for name in updated)
+    return f"WHERE ({current}) IS DISTINCT FROM ({excluded})"
@@ -0,0 +1,22 @@
+-- +goose Up
+-- Compact layout of emd: one float4 array per quantity, as long as the number of
+-- IMFs the sift found (no NULL padding, any max_imfs)
+CREATE TABLE IF NOT EXISTS emd_compact (
+    Instrument BIGINT NOT NULL,
+    Resolution RESOLUTION NOT NULL,
+    Fdim NUMERIC NOT NULL,
+    Epoch TIMESTAMP NOT NULL,
+    Imf REAL[] NOT NULL,
+    If REAL[] NOT NULL,
+    Ia REAL[] NOT NULL,
+    Ip REAL[] NOT NULL,
+    PRIMARY KEY (Instrument, Resolution, Fdim, Epoch),
+    FOREIGN KEY (Instrument) REFERENCES instrument(id)
+);
+
+-- The primary key index is scanned backwards for the latest Epochs, so no extra
+-- (..., Epoch DESC) index is created
+
+
+-- +goose Down
+DROP TABLE IF EXISTS emd_compact;
@@ -0,0 +1,90 @@
+-- +goose Up
+-- Range-partitions the time series tables by month of Epoch. Partitions are named
+-- {table}_yYYYYmMM and are created on demand by create_month_partition, which the
+-- writers call before writing a month; old months are detached and dropped by the
+-- retention job instead of DELETE.
+
+-- +goose StatementBegin
+CREATE OR REPLACE FUNCTION create_month_partition(parent TEXT, month DATE) RETURNS TEXT AS $$
+DECLARE
+    start_month DATE := date_trunc('month', month)::date;
+    child TEXT := format('%s_y%sm%s', parent, to_char(start_month, 'YYYY'), to_char(start_month, 'MM'));
+BEGIN
+    -- 既にあれば親テーブルのロックを取らずに返す
+    IF to_regclass(child) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            child, parent, start_month, (start_month + INTERVAL '1 month')::date
+        );
+    END IF;
+    RETURN child;
+END;
+$$ LANGUAGE plpgsql;
+-- +goose StatementEnd
+
+-- +goose StatementBegin
+CREATE OR REPLACE FUNCTION partition_by_month(parent TEXT) RETURNS VOID AS $$
+DECLARE
+    old TEXT := parent || '_unpartitioned';
+    fk RECORD;
+    first_month DATE;
+    last_month DATE;
+BEGIN
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', parent, old);
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES) PARTITION BY RANGE (Epoch)',
+        parent, old
+    );
+    FOR fk IN SELECT conname, pg_get_constraintdef(oid) AS def FROM pg_constraint WHERE conrelid = old::regclass AND contype = 'f' LOOP
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I %s', parent, fk.conname, fk.def);
+    END LOOP;
+
+    EXECUTE format('SELECT date_trunc(''month'', min(Epoch))::date, date_trunc(''month'', max(Epoch))::date FROM %I', old)
+        INTO first_month, last_month;
+    first_month := COALESCE(first_month, date_trunc('month', now())::date);
+    last_month := GREATEST(COALESCE(last_month, first_month), date_trunc('month', now())::date) + INTERVAL '1 month';
+    WHILE first_month <= last_month LOOP
+        PERFORM create_month_partition(parent, first_month);
+        first_month := first_month + INTERVAL '1 month';
+    END LOOP;
+
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', parent, old);
+    EXECUTE format('DROP TABLE %I', old);
+END;
+$$ LANGUAGE plpgsql;
+-- +goose StatementEnd
+
+SELECT partition_by_month('ohlcvt');
+SELECT partition_by_month('ffd');
+SELECT partition_by_month('emd');
+SELECT partition_by_month('emd_compact');
+SELECT partition_by_month('premium_index');
+
+
+-- +goose Down
+-- +goose StatementBegin
+CREATE OR REPLACE FUNCTION unpartition(parent TEXT) RETURNS VOID AS $$
+DECLARE
+    old TEXT := parent || '_partitioned';
+    fk RECORD;
+BEGIN
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', parent, old);
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES)', parent, old);
+    FOR fk IN SELECT conname, pg_get_constraintdef(oid) AS def FROM pg_constraint WHERE conrelid = old::regclass AND contype = 'f' LOOP
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I %s', parent, fk.conname, fk.def);
+    END LOOP;
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', parent, old);
+    EXECUTE format('DROP TABLE %I CASCADE', old);
+END;
+$$ LANGUAGE plpgsql;
+-- +goose StatementEnd
+
+SELECT unpartition('ohlcvt');
+SELECT unpartition('ffd');
+SELECT unpartition('emd');
+SELECT unpartition('emd_compact');
+SELECT unpartition('premium_index');
+
+DROP FUNCTION IF EXISTS unpartition(TEXT);
+DROP FUNCTION IF EXISTS partition_by_month(TEXT);
+DROP FUNCTION IF EXISTS create_month_partition(TEXT, DATE);
@@ -0,0 +1,76 @@
+-- +goose Up
+-- Registry of the feature parameter sets. ffd, emd and emd_compact are keyed on
+-- its integer id instead of the NUMERIC Fdim, so index entries are fixed
+-- width and lookups no longer depend on a float round-tripping through NUMERIC.
+CREATE TABLE IF NOT EXISTS feature_params (
+    id SERIAL PRIMARY KEY,
+    Fdim NUMERIC NOT NULL,
+    Thresh NUMERIC NOT NULL,
+    MaxImfs INT NOT NULL,
+    UNIQUE (Fdim, Thresh, MaxImfs)
+);
+
+-- Rows written before the registry only recorded Fdim; they are registered with
+-- the default thresh (1e-4) and max_imfs (16) of the flows
+INSERT INTO feature_params (Fdim, Thresh, MaxImfs)
+SELECT DISTINCT Fdim, 1e-4, 16 FROM (
+    SELECT DISTINCT Fdim FROM ffd
+    UNION SELECT DISTINCT Fdim FROM emd
+    UNION SELECT DISTINCT Fdim FROM emd_compact
+) AS fdims
+ON CONFLICT DO NOTHING;
+
+-- +goose StatementBegin
+CREATE OR REPLACE FUNCTION key_on_params(parent TEXT) RETURNS VOID AS $$
+DECLARE
+    pkey TEXT;
+BEGIN
+    EXECUTE format('ALTER TABLE %I ADD COLUMN Params INTEGER REFERENCES feature_params(id)', parent);
+    EXECUTE format(
+        'UPDATE %I t SET Params = f.id FROM feature_params f WHERE f.Fdim = t.Fdim AND f.Thresh = 1e-4 AND f.MaxImfs = 16',
+        parent
+    );
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN Params SET NOT NULL', parent);
+
+    SELECT conname INTO pkey FROM pg_constraint WHERE conrelid = parent::regclass AND contype = 'p';
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', parent, pkey);
+    -- Drops the (..., Fdim, Epoch DESC) index too; like emd_compact, the primary key
+    -- index scanned backwards serves the latest Epochs
+    EXECUTE format('ALTER TABLE %I DROP COLUMN Fdim', parent);
+    EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (Instrument, Resolution, Params, Epoch)', parent);
+END;
+$$ LANGUAGE plpgsql;
+-- +goose StatementEnd
+
+SELECT key_on_params('ffd');
+SELECT key_on_params('emd');
+SELECT key_on_params('emd_compact');
+
+DROP FUNCTION key_on_params(TEXT);
+
+
+-- +goose Down
+-- +goose StatementBegin
+CREATE OR REPLACE FUNCTION key_on_fdim(parent TEXT) RETURNS VOID AS $$
+DECLARE
+    pkey TEXT;
+BEGIN
+    EXECUTE format('ALTER TABLE %I ADD COLUMN Fdim NUMERIC', parent);
+    EXECUTE format('UPDATE %I t SET Fdim = f.Fdim FROM feature_params f WHERE f.id = t.Params', parent);
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN Fdim SET NOT NULL', parent);
+
+    SELECT conname INTO pkey FROM pg_constraint WHERE conrelid = parent::regclass AND contype = 'p';
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', parent, pkey);
+    EXECUTE format('ALTER TABLE %I DROP COLUMN Params', parent);
+    -- Fails if one Fdim was written with several thresh/max_imfs (duplicate keys)
+    EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (Instrument, Resolution, Fdim, Epoch)', parent);
+END;
+$$ LANGUAGE plpgsql;
+-- +goose StatementEnd
+
+SELECT key_on_fdim('ffd');
+SELECT key_on_fdim('emd');
+SELECT key_on_fdim('emd_compact');
+
+DROP FUNCTION key_on_fdim(TEXT);
+DROP TABLE IF EXISTS feature_params;